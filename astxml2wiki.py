@@ -3,15 +3,94 @@
 import sys, os, re, difflib
 import lxml.etree as etree
 import version
+import manifest
+import journal
+import wikiconvert
+import convcache
+import mirror
+import sitewriter
+import wikirender
+import storageformat
+import fingerprints
+import crossref
+import runreport
+import time
+import confluence
+import hashlib
 import string
-import copy
 from optparse import OptionParser
 import subprocess
-from xmlrpclib import Server
+import threading
+import Queue
+import multiprocessing
+import xmlrpclib
+import unittest
+import tempfile
+import shutil
+
+XINCLUDE = '{http://www.w3.org/2001/XInclude}include'
+
+# What can be done with pages that no longer document anything; see reconcile()
+ORPHAN_ACTIONS = ['report', 'label', 'move']
+
+# The largest share of the pages under the topic parents that one run will
+# label or move; a run that orphans more is more likely broken than right
+ORPHAN_LIMIT = 0.25
+
+# What elements can be rendered to wiki markup with; see renderer()
+RENDERERS = ['xslt', 'python']
+
+# The files each renderer's pages depend on, besides this one; with --since,
+# a change to any of them republishes every page (see fingerprints.py)
+RENDERER_SOURCES = {
+    'xslt': ['astxml2wiki.xslt'],
+    'python': [os.path.splitext(wikirender.__file__)[0] + '.py'],
+}
+
+# How the footer of every page starts; it names the version the page was
+# imported from, so it's left out when pages are compared
+FOOTER = "This documentation was imported from"
 
 def escape(string):
     return re.sub(r'([\{\}\[\]^_])', r'\\\1', string)
 
+def utf8(text):
+    '''Text to write out, with unicode (such as storage format converted
+    locally) encoded as UTF-8 whatever stdout's encoding is'''
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+def renderer(name, xslt, prefix):
+    '''A function rendering an element to wiki markup, with the compiled
+    stylesheet or, for the python renderer, wikirender.py'''
+    if name == 'python':
+        return wikirender.Renderer(prefix).render
+    prefix = etree.XSLT.strparam(prefix)
+    return lambda node: str(xslt(node, prefix=prefix))
+
+# Renders elements in a rendering process; see render_init()
+render_node = None
+
+def render_init(stylesheet, prefix, name):
+    '''Sets up the renderer in a rendering process, compiling the
+    stylesheet once if it's needed'''
+    global render_node
+    xslt = None
+    if name == 'xslt':
+        xslt = etree.XSLT(etree.parse(stylesheet))
+    render_node = renderer(name, xslt, prefix)
+
+def render(page):
+    '''Renders a serialized element to wiki markup in a rendering process,
+    returning the wall clock and CPU time it took too'''
+    pagetitle, tag, source = page
+    wall = time.time()
+    cpu = runreport.cpu_time()
+    wiki = render_node(etree.fromstring(source))
+    return (pagetitle, tag, wiki, time.time() - wall,
+            runreport.cpu_time() - cpu)
+
 def call(*args, **kwargs):
     '''Invokes subprocess.call, calling sys.exit if it fails'''
     res = subprocess.call(*args, **kwargs)
@@ -20,7 +99,12 @@ def call(*args, **kwargs):
         sys.exit(1)
 
 class AstXML2Wiki:
-    def __init__(self, argv):
+    def __init__(self, argv, session=None):
+        ''' Parse the command line, and log into Confluence.  A publish of
+        several branches in one process (see publish-branches.py) passes
+        another instance as the session, whose login, compiled stylesheet,
+        manifest and conversion cache are then shared rather than set up
+        again. '''
         usage = "Usage: ./astxml2wiki.py " \
             "--username=USERNAME --password=PASSWORD " \
             "--server=http://example.com/rpc/xmlrpc " \
@@ -29,7 +113,31 @@ class AstXML2Wiki:
             "--file=/path/to/core-en_US.xml [--force] " \
             "--debug " \
             "--force-convert " \
-            "--diff"
+            "--diff " \
+            "--jobs=N " \
+            "--connections=N " \
+            "--manifest=/path/to/manifest.json " \
+            "--verify-remote " \
+            "--stream " \
+            "--render-jobs=N " \
+            "--renderer=xslt|python " \
+            "--retries=N " \
+            "--rate=N " \
+            "--local-convert " \
+            "--record-conversions=/path/to/dir " \
+            "--conversion-cache=/path/to/cache.db " \
+            "--conversion-cache-size=N " \
+            "--mirror=/path/to/mirror.db " \
+            "--output-dir=/path/to/dir " \
+            "--output-format=wiki|html " \
+            "--since=/path/to/old-docs.xml|/path/to/fingerprints.json " \
+            "--save-fingerprints=/path/to/fingerprints.json " \
+            "--orphans=report|label|move " \
+            "--orphan-label=LABEL " \
+            "--orphan-parent=TITLE " \
+            "--report=/path/to/report.json " \
+            "--journal=/path/to/journal.jsonl " \
+            "--resume"
             # the debug flag obviates any need for user, password, or server
             # and will make no attempt to contact the server even if provided
 
@@ -42,9 +150,12 @@ class AstXML2Wiki:
             'replaceable': ('_','_'),
             'astcli': ('{{','}}')}
 
-        self.s = ''
+        self.topics = ['manager', 'application', 'function', 'agi',
+                       'managerEvent', 'configInfo']
+
         self.path = ''
         self.token = ''
+        self.api = None
         self.thingschanged = True
         self.elements = []
         self.args = {
@@ -60,12 +171,39 @@ class AstXML2Wiki:
             'debug': False,
             'force-convert': False,
             'diff': False,
+            'jobs': '1',
+            'connections': '',
+            'manifest': manifest.DEFAULT_PATH,
+            'verify-remote': False,
+            'stream': False,
+            'render-jobs': '1',
+            'renderer': 'xslt',
+            'retries': '5',
+            'rate': '0',
+            'local-convert': False,
+            'record-conversions': '',
+            'conversion-cache': convcache.DEFAULT_PATH,
+            'conversion-cache-size': str(convcache.DEFAULT_SIZE),
+            'mirror': '',
+            'output-dir': '',
+            'output-format': 'wiki',
+            'since': '',
+            'save-fingerprints': '',
+            'orphans': 'report',
+            'orphan-label': 'obsolete',
+            'orphan-parent': '',
+            'report': os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'publish-report.json'),
+            'journal': None,
+            'resume': False,
             'ast-version': 'Unknown'
         }
         self.processed = {
             'unchanged': 0,
             'updated': 0,
-            'created': 0
+            'created': 0,
+            'orphaned': 0,
+            'resumed': 0
         }
 
         argv.pop(0)
@@ -98,13 +236,122 @@ class AstXML2Wiki:
             print >> sys.stderr, usage
             sys.exit(2)
 
+        try:
+            self.jobs = int(self.args['jobs'])
+            self.render_jobs = int(self.args['render-jobs'])
+            # Publishes sharing this one's session need connections too
+            self.connections = int(self.args['connections'] or self.jobs)
+        except ValueError:
+            self.jobs = 0
+        if self.jobs < 1 or self.render_jobs < 1 or self.connections < 1:
+            print >> sys.stderr, "--jobs, --render-jobs and --connections must be positive numbers."
+            sys.exit(2)
+
+        if self.args['renderer'] not in RENDERERS:
+            print >> sys.stderr, "--renderer must be one of %s." % \
+                ', '.join(RENDERERS)
+            sys.exit(2)
+
+        try:
+            self.retries = int(self.args['retries'])
+            self.rate = float(self.args['rate'])
+        except ValueError:
+            self.retries = -1
+        if self.retries < 0 or self.rate < 0:
+            print >> sys.stderr, "--retries and --rate must not be negative."
+            sys.exit(2)
+
+        # Pages are published from a pool of worker threads; the lock guards
+        # the processed counters and keeps per-page output together.
+        self.lock = threading.Lock()
+        self.failed = None
+        self.session = session
+
+        # Where the time goes; written out on every run, unless --report=
+        if session is not None:
+            self.report = session.report
+        else:
+            self.report = runreport.Report('astxml2wiki.py')
+
+        # The stylesheet is only compiled once, however many branches share it
+        if session is not None:
+            self.xslt = session.xslt
+        else:
+            self.xslt = etree.XSLT(etree.parse('astxml2wiki.xslt'))
+
+        # Pages are published to Confluence unless they're being printed
+        # (--debug) or written to files (--output-dir)
+        self.offline = self.args['debug'] is True or \
+            self.args['output-dir'] != ''
+        self.output = None
+        self.backend = self.publish
+        if self.args['output-dir'] and not self.args['debug']:
+            if self.args['output-format'] not in sitewriter.FORMATS:
+                print >> sys.stderr, "--output-format must be one of %s." % \
+                    ', '.join(sitewriter.FORMATS)
+                sys.exit(2)
+            self.output = sitewriter.SiteWriter(self.args['output-dir'],
+                                                self.args['output-format'])
+            self.backend = self.write_page
+
+        if self.args['orphans'] not in ORPHAN_ACTIONS:
+            print >> sys.stderr, "--orphans must be one of %s." % \
+                ', '.join(ORPHAN_ACTIONS)
+            sys.exit(2)
+        if self.args['orphans'] == 'move' and not self.args['orphan-parent']:
+            print >> sys.stderr, "--orphans=move needs an --orphan-parent."
+            sys.exit(2)
+
+        # Existing pages, by title, and the children of each topic's parent
+        # page; see index_pages()
+        self.index = {}
+        self.space_index = None
+        self.children = {}
+
+        # The pages generated by this run; see reconcile()
+        self.documented = set()
+
+        # Every element's page, and the see-also links of the ones being
+        # published, to find the links that lead nowhere; see check_links()
+        self.xrefs = crossref.Index(self.args['prefix'])
+
+        # With --since, only elements that changed since the given dump (or
+        # its saved fingerprints) are published; see changed().  Saved
+        # fingerprints only count if the pages are rendered the same way.
+        self.previous = None
+        self.prints = None
+        self.removed = []
+        self.rendered = None
+        if self.args['since'] or self.args['save-fingerprints']:
+            self.prints = {}
+            self.rendered = fingerprints.renderer(
+                [os.path.splitext(os.path.abspath(__file__))[0] + '.py'] +
+                RENDERER_SOURCES[self.args['renderer']], self.args['prefix'])
+        if self.args['since']:
+            self.previous = fingerprints.load(self.args['since'], self.topics,
+                                              self.rendered)
+
+        # The pages that were published, or found up to date, by this run
+        self.succeeded = set()
+
+        # What was published last time; an empty --manifest= turns this off
+        self.manifest = None
+        if session is not None:
+            self.manifest = session.manifest
+        elif self.args['manifest'] and not self.offline:
+            self.manifest = manifest.Manifest(self.args['manifest'])
+
         self.convert = False
 
         # If password isn't on the command line, check the environment
         if not self.args['password']:
             self.args['password'] = os.environ.get('CONFLUENCE_PASSWORD', '')
 
-        if not self.args['debug'] or self.args['force-convert']:
+        if session is not None:
+            self.api = session.api
+            self.token = session.token
+            self.convert = session.convert
+        elif not self.offline or self.args['force-convert']:
             if self.args['username'] == '' or self.args['password'] == '':
                 print >> sys.stderr, "Please specify a username and a password."
                 sys.exit(1)
@@ -118,23 +365,65 @@ class AstXML2Wiki:
                 print >> sys.stderr, "Please specify a Confluence XMLRPC URL."
                 sys.exit(3)
 
-            self.s = Server(self.args['server'])
-            try:
-                self.token = self.s.confluence2.login(
-                    self.args['username'], self.args['password']
-                )
-                self.api = self.s.confluence2
+            # One client, and its pool of connections, is shared by all of
+            # the publishing threads
+            self.api = confluence.Confluence(self.args['server'],
+                                             connections=self.connections,
+                                             retries=self.retries,
+                                             rate=self.rate,
+                                             report=self.report)
+            self.token = self.api.login(self.args['username'],
+                                        self.args['password'])
+            if self.api.version == 'confluence2':
                 self.convert = True
-            except:
-                self.token = self.s.confluence1.login(
-                    self.args['username'], self.args['password']
-                )
-                self.api = self.s.confluence1
 
             if self.token is None or self.token == '':
                 print >> sys.stderr, "Could not log into Confluence!"
                 sys.exit(4)
 
+        # Each page published is checkpointed, so that a run that dies part
+        # way through can be picked up again with --resume
+        self.journal = None
+        if session is not None:
+            self.journal = session.journal
+        elif self.args['journal'] != '' and not self.offline and \
+            not self.args['diff']:
+            # Without --journal, each space and prefix has its own
+            if self.args['journal'] is None:
+                self.args['journal'] = journal.default_path(
+                    self.args['space'], self.args['prefix'])
+            try:
+                self.journal = journal.Journal(self.args['journal'],
+                                               self.args['resume'] is True)
+            except IOError, e:
+                print >> sys.stderr, "Could not open the journal: %s" % e
+                sys.exit(1)
+
+        # Servers that store wiki markup as-is don't need converting
+        if self.args['local-convert'] is True and \
+            (self.args['debug'] or self.convert):
+            self.convert = True
+
+        # Conversions done by the server are kept from run to run; an empty
+        # --conversion-cache= turns this off
+        self.cache = None
+        if session is not None:
+            self.cache = session.cache
+        elif self.convert and self.args['local-convert'] is not True and \
+            self.args['conversion-cache']:
+            self.cache = convcache.ConversionCache(
+                self.args['conversion-cache'], self.args['server'],
+                int(self.args['conversion-cache-size']))
+
+        # The pages on the server, as this and earlier runs last saw them, if
+        # asked for; see mirror.py
+        self.mirror = None
+        if session is not None:
+            self.mirror = session.mirror
+        elif not self.offline and self.args['mirror']:
+            self.mirror = mirror.Mirror(self.args['mirror'],
+                                        self.args['server'])
+
     def build(self):
         ''' checkout Asterisk from source and build the documentation to use.
         This only gets run if a subversion repository URL is passed to the
@@ -186,32 +475,32 @@ class AstXML2Wiki:
     def build_paragraph_contents(self, node):
         ''' First pass on the XML node.  For each para node, we need to replace
         out the formatting markup - using an XSLT to do this job is tricky, as
-        it won't necessarily preserve the order of text/markup '''
+        it won't necessarily preserve the order of text/markup.  The paragraph
+        is rebuilt in a single walk over its text, children and their tails,
+        so markup is applied in document order. '''
         for paragraph in node.getiterator('para'):
-            current_text = ''
+            if not paragraph.text and not len(paragraph):
+                continue
+
+            current_text = []
             if paragraph.text:
-                children = paragraph.getchildren()
-		# Emulate the itertext function
-		paragraph_text = []
-		for p in paragraph.getiterator():
-		    if p.text:
-                        paragraph_text.append(p.text)
-                    if p.tail:
-                        paragraph_text.append(p.tail)
-
-                for t in paragraph_text:
-                    match = [markup for markup in children if markup.text == t]
-                    if len(match):
-                        # Just use the first.
-                        markup = match[0]
-                        if markup.tag in self._markup_tags.keys():
-                            current_text += '%s%s%s' % (self._markup_tags[markup.tag][0], \
-                            escape(t), self._markup_tags[markup.tag][1])
-                    else:
-                        current_text += escape(t)
-                for c in children:
-                    paragraph.remove(c)
-                paragraph.text = current_text.replace('\n', ' ').replace('\t','')
+                current_text.append(escape(paragraph.text))
+            for child in paragraph:
+                if child.text and child.tag in self._markup_tags:
+                    current_text.append('%s%s%s' % (
+                        self._markup_tags[child.tag][0], escape(child.text),
+                        self._markup_tags[child.tag][1]))
+                # Anything nested inside the markup is kept as plain text
+                for grandchild in child:
+                    text = etree.tostring(grandchild, method='text',
+                                          encoding=unicode, with_tail=True)
+                    current_text.append(escape(text))
+                if child.tail:
+                    current_text.append(escape(child.tail))
+
+            for c in paragraph.getchildren():
+                paragraph.remove(c)
+            paragraph.text = ''.join(current_text).replace('\n', ' ').replace('\t','')
 
         # values may also need to be escaped
         for value in node.getiterator('value'):
@@ -223,215 +512,720 @@ class AstXML2Wiki:
 
         return node
 
-    def build_seealso_references(self, node):
-        # refnodes may be shared between nodes so we make a copy of everything
-        # so we don't modify things multiple times
-        node = copy.deepcopy(node)
-        refnodes = node.getiterator('ref')
-        for refnode in refnodes:
-            type = refnode.attrib.get('type')
-            module = refnode.attrib.get('module')
-            if not module:
-                module = ''
-            else:
-                module = '_%s' % module
-            link = refnode.text
-            if type == 'manager':
-                link = '[' + self.args['prefix'] + 'ManagerAction_%s%s]\n' % (link, module)
-            elif type == 'application':
-                link = '[' + self.args['prefix'] + 'Application_%s%s]\n' % (link, module)
-            elif type == 'function':
-                link = '[' + self.args['prefix'] + 'Function_%s%s]\n' % (link, module)
-            elif type == 'agi':
-                link = '[' + self.args['prefix'] + 'AGICommand_%s%s]\n' % (link, module)
-            elif type == 'managerEvent':
-                link = '[' + self.args['prefix'] + 'ManagerEvent_%s%s]\n' % (link, module)
-            elif type == 'configInfo':
-                link = '[' + self.args['prefix'] + 'Configuration_%s%s]\n' % (link, module)
-            else:
-                # This is either "filename" or "manpage"
-                link = '{{%s}}\n' % link
-            refnode.text = link
-
-        return node
-
     def parse(self):
         ''' Collect and do the first pass of formatting on the XML nodes for each
         major type '''
 
 	print self.args['file']
-        self.xmltree = etree.parse(self.args['file'])
-        self.xmltree.xinclude()
+        if self.args['stream'] is True:
+            # Elements are read, formatted and published one at a time
+            self.elements = self.iterelements()
+            return
+
+        with self.report.phase('parse'):
+            self.xmltree = etree.parse(self.args['file'])
+            self.xmltree.xinclude()
         for child in self.xmltree.getiterator():
-            if child.tag == 'application' or \
-                child.tag == 'manager' or \
-                child.tag == 'agi' or \
-                child.tag == 'function' or \
-                child.tag == 'configInfo' or \
-                child.tag == 'managerEvent':
-
-                # Two things have to be constructed here.  The paragraph contents,
-                # as we have XML embedded with text - and that's just not easy to
-                # do in XSLT (without doing multiple XSLT passes).  The ref links
-                # have to be built here, as we have the information to build the
-                # page links based on what was passed in to this script.
-                child = self.build_paragraph_contents(child)
-                child = self.build_seealso_references(child)
-                self.elements.append(child)
+            if child.tag not in self.topics:
+                continue
+            self.xrefs.add(child)
+            if self.changed(child):
+                self.elements.append(self.prepare(child))
+
+    def iterelements(self):
+        ''' Stream the documentation, yielding each element for a major type
+        as soon as it has been read.  Once the caller is done with an element
+        it is cleared, so memory use doesn't grow with the size of the docs.
+        XIncludes can't be processed in this mode. '''
+
+        warned = False
+        for event, child in etree.iterparse(self.args['file'], events=('end',)):
+            if child.tag == XINCLUDE and not warned:
+                print >> sys.stderr, "XIncludes are not processed with --stream"
+                warned = True
+            if child.tag not in self.topics:
+                continue
+
+            self.xrefs.add(child)
+            if self.changed(child):
+                yield self.prepare(child)
+
+            # Only clear elements directly under the root; nested ones are
+            # still part of an element that hasn't been yielded yet.
+            parent = child.getparent()
+            if parent is not None and parent.getparent() is None:
+                child.clear()
+                while child.getprevious() is not None:
+                    del parent[0]
+
+    def changed(self, child):
+        ''' Whether an element needs publishing.  With --since, only those
+        added or changed since the previous dump do.  The fingerprints are
+        kept, to save and to find the elements that were removed. '''
+        if self.prints is None:
+            return True
+        key = fingerprints.key(child)
+        self.prints[key] = fingerprints.fingerprint(child)
+        return self.previous is None or \
+            self.previous.get(key) != self.prints[key]
+
+    def prepare(self, child):
+        ''' First pass of formatting on an element for a major type '''
+
+        # The paragraph contents have to be constructed here, as we have XML
+        # embedded with text - and that's just not easy to do in XSLT
+        # (without doing multiple XSLT passes).  The ref links are built by
+        # the stylesheet, from the prefix passed in at render time.
+        self.xrefs.refs(child)
+        with self.report.phase('build_paragraph_contents'):
+            return self.build_paragraph_contents(child)
 
 
     def update(self):
         ''' format the wiki pages and update Confluence '''
 
-        newpage = {'space': self.args['space']}
-        xslt = etree.XSLT(etree.parse('astxml2wiki.xslt'))
-        topics = ['manager','application','function','agi','managerEvent','configInfo']
+        # The per-page round trips are independent of each other, so they are
+        # handed off to a bounded pool of worker threads.  Rendering stays on
+        # this thread; the queue bound keeps it from racing too far ahead.
+        pages = Queue.Queue(self.jobs * 2)
+        workers = []
+        complete = False
+        try:
+            topics = list(self.topics)
+
+            # HACK - guess version from prefix
+
+            # managerEvent introduced in Asterisk 11
+            if self.args['prefix'] == '' or self.args['prefix'] == "Asterisk 10 ":
+                topics.remove('managerEvent')
+
+            # configInfo introduced in Asterisk 12
+            if self.args['prefix'] == '' or self.args['prefix'] == "Asterisk 10 " or self.args['prefix'] == "Asterisk 11 ":
+                topics.remove('configInfo')
+
+            if self.args['v'] is True:
+                print "Updating Confluence"
+
+            for f in topics:
+                # Get the ids of the parent pages
+                if f == 'manager':
+                    pagetitle = '%sAMI Actions' % self.args['prefix']
+                elif f == 'application':
+                    pagetitle = '%sDialplan Applications' % self.args['prefix']
+                elif f == 'function':
+                    pagetitle = '%sDialplan Functions' % self.args['prefix']
+                elif f == 'agi':
+                    pagetitle = '%sAGI Commands' % self.args['prefix']
+                elif f == 'managerEvent':
+                    pagetitle = '%sAMI Events' % self.args['prefix']
+                elif f == 'configInfo':
+                    pagetitle = '%sModule Configuration' % self.args['prefix']
+
+                if not pagetitle:
+                    print("Unknown topic: %s" % f)
+                    raise Exception
+
+                if not self.offline:
+                    if self.args['v'] is True:
+                        print "getPage(%s, %s, %s)" % (self.token, self.args['space'], self.parent[f])
+
+                    try:
+                        elpage = self.api.getPage(
+                            self.args['space'], self.parent[f])
+                        self.parent[f] = elpage['id']
+                    except xmlrpclib.Fault:
+                        # The page doesn't exist; connection failures have been
+                        # retried already, and shouldn't lead to creating pages
+                        print >>sys.stderr, "Exception getting %s/%s" % (self.args['space'], self.parent[f])
+                        print("Attempting to create %s" % pagetitle)
+                        parentname = "%sCommand Reference" % self.args['prefix']
+                        print("Getting parent %s %s" % (self.args['space'], parentname))
+                        parent = self.api.getPage(self.args['space'], parentname)
+                        print("Got parent %s %s" % (parent['id'], parent['title']))
+                        newpage = {
+                            'space': self.args['space'],
+                            'parentId': parent['id'],
+                            'title': pagetitle,
+                            'content': "",
+                        }
+                        self.api.storePage(newpage)
+                        elpage = self.api.getPage(
+                            self.args['space'], self.parent[f])
+                        self.parent[f] = elpage['id']
+
+            if not self.offline:
+                self.index_pages(topics)
+
+            # Where orphaned pages are moved to has to exist already
+            self.orphan_parent = None
+            if not self.offline and self.args['orphans'] == 'move':
+                try:
+                    self.orphan_parent = self.api.getPage(
+                        self.args['space'], self.args['orphan-parent'])['id']
+                except xmlrpclib.Fault:
+                    print >> sys.stderr, "Could not find %s/%s" % (
+                        self.args['space'], self.args['orphan-parent'])
+                    sys.exit(1)
+
+            if not self.args['debug']:
+                for i in range(self.jobs):
+                    worker = threading.Thread(target=self.publish_worker,
+                                              args=(pages,))
+                    worker.daemon = True
+                    worker.start()
+                    workers.append(worker)
+
+            rendered = False
+            for pagetitle, tag, wiki in self.render():
+                if self.failed:
+                    break
 
-        # HACK - guess version from prefix
+                wiki += "\nh3. Import Version\n\n"
+                wiki += ("%s Asterisk Version %s" % (FOOTER, self.ast_v))
 
-        # managerEvent introduced in Asterisk 11
-        if self.args['prefix'] == '' or self.args['prefix'] == "Asterisk 10 ":
-            topics.remove('managerEvent')
+                self.documented.add(pagetitle)
 
-        # configInfo introduced in Asterisk 12
-        if self.args['prefix'] == '' or self.args['prefix'] == "Asterisk 10 " or self.args['prefix'] == "Asterisk 11 ":
-            topics.remove('configInfo')
+                if self.args['debug']:
+                    # convert wiki markup to storage format, if needed
+                    if self.convert:
+                        wiki = self.convert_wiki(wiki)
+                    print utf8(pagetitle)
+                    print utf8(wiki)
+                    continue
 
+                pages.put((self.backend, (pagetitle, wiki, tag)))
+            else:
+                rendered = True
+
+            # Only a run that rendered everything knows which pages are orphans
+            if rendered and not self.offline and not self.failed:
+                self.reconcile(pages)
+            complete = rendered
+        finally:
+            # Whatever stopped the run, what it did is saved: the pages
+            # already handed to the publishing threads are finished, and the
+            # manifest, the caches and the report are written out
+            for worker in workers:
+                pages.put(None)
+            for worker in workers:
+                worker.join()
+
+            if self.output:
+                self.output.close()
+            if self.manifest:
+                self.manifest.save()
+            if complete and not self.failed:
+                self.compare_fingerprints()
+                self.check_links()
+            self.save_fingerprints()
+
+            self.report.count(self.processed)
+            if self.session is None:
+                self.close(complete and not self.failed)
+
+        if self.failed:
+            raise self.failed[0], self.failed[1], self.failed[2]
+
+    def reconcile(self, pages):
+        ''' Find the pages under the topic parents that this run didn't
+        generate - usually documentation for something since removed from
+        Asterisk.  They are found in the children listed by index_pages(),
+        rather than looked up one by one.  They are reported and, with
+        --orphans, labelled or moved by the publishing threads - unless the
+        run documented nothing, or would orphan more than ORPHAN_LIMIT of
+        the pages, when they are only reported.  The XML-RPC API has no
+        call that labels or moves more than one page, so this isn't batched:
+        each orphan is one addLabelByName or movePage call, made in parallel
+        with the others rather than together. '''
+        documented = set(self.documented)
+        if self.prints is not None:
+            # With --since, unchanged elements weren't rendered
+            documented.update(self.key_title(key) for key in self.prints)
+
+        action = self.args['orphans']
+        if self.args['diff']:
+            action = 'report'
+
+        children = 0
+        orphans = []
+        for f in sorted(self.children):
+            children += len(self.children[f])
+            orphans.extend((pagetitle, page_id)
+                           for pagetitle, page_id in self.children[f]
+                           if pagetitle not in documented)
+
+        if action != 'report' and orphans and \
+            (not documented or len(orphans) > children * ORPHAN_LIMIT):
+            print >> sys.stderr, "Not acting on %d orphaned pages of %d, " \
+                "as %s; they are only reported." % (
+                    len(orphans), children,
+                    documented and "that is too many" or
+                    "nothing was documented")
+            action = 'report'
+
+        for pagetitle, page_id in orphans:
+            with self.lock:
+                self.processed['orphaned'] += 1
+                print pagetitle, " orphaned"
+            if action == 'label':
+                pages.put((self.api.addLabelByName,
+                           (self.args['orphan-label'], page_id)))
+            elif action == 'move':
+                pages.put((self.api.movePage,
+                           (page_id, self.orphan_parent, 'append')))
+
+    def key_title(self, key):
+        ''' The title of the page documenting the element with a fingerprint
+        key (see fingerprints.py) '''
+        tag, name, module = fingerprints.split_key(key)
+        node = etree.Element(tag, name=name)
+        if module:
+            node.set('module', module)
+        return self.page_title(node)
+
+    def compare_fingerprints(self):
+        ''' Report the pages of elements that have been removed since the
+        previous dump '''
+        if self.previous is not None:
+            for key in sorted(set(self.previous) - set(self.prints)):
+                self.removed.append(self.key_title(key))
+            if self.args['v'] is True:
+                changed = [key for key in self.prints
+                           if self.previous.get(key) != self.prints[key]]
+                print "%d changed, %d removed since %s" % (
+                    len(changed), len(self.removed), self.args['since'])
+                for pagetitle in self.removed:
+                    print pagetitle, " removed"
+
+    def save_fingerprints(self):
+        ''' Save the fingerprints of this dump, for a later --since.  Even a
+        run that failed saves them, but an element whose page it didn't
+        publish keeps the fingerprint it had before, if any, so the next run
+        publishes it again. '''
+        # A dry run hasn't published anything to compare the next run with
+        if not self.args['save-fingerprints'] or self.args['debug'] or \
+            self.args['diff']:
+            return
+        prints = {}
+        for key, fingerprint in self.prints.items():
+            previous = (self.previous or {}).get(key)
+            if fingerprint == previous or \
+                self.key_title(key) in self.succeeded:
+                prints[key] = fingerprint
+            elif previous is not None:
+                prints[key] = previous
+        fingerprints.save(self.args['save-fingerprints'], prints,
+                          self.rendered)
+
+    def check_links(self):
+        ''' Check the see-also links of the pages published against the
+        pages of every element in the documentation.  Links that lead
+        nowhere, or only to a page without the module they name, are
+        counted in the report and listed with -v.  This waits until all of
+        the documentation has been read, as with --stream a page can link to
+        an element further on. '''
+        dangling, fallbacks = self.xrefs.check()
+        self.report.count({
+            'links': len(self.xrefs.links),
+            'dangling_links': len(dangling),
+            'fallback_links': len(fallbacks),
+        })
         if self.args['v'] is True:
-            print "Updating Confluence"
+            for source, missing in dangling:
+                print "%s links to missing %s" % (source, missing)
+            for source, missing, found in fallbacks:
+                print "%s links to missing %s, falls back to %s" % (
+                    source, missing, found)
+
+    def close(self, complete=True):
+        ''' Write out the conversion cache and the run report, and finish
+        the journal; it's kept for --resume if the run didn't complete.  Left
+        to the session's owner when they're shared. '''
+        if self.cache:
+            self.cache.close()
+        if self.mirror:
+            self.mirror.close()
+        if self.journal:
+            self.journal.close(complete)
+        if self.args['report']:
+            self.report.save(self.args['report'])
+
+    def page_title(self, node):
+        ''' The title of the page documenting an element '''
+        name = node.attrib.get('name')
+        module = node.attrib.get('module')
+        if not name:
+            raise ValueError('name undefined for node')
+        if node.tag == 'manager':
+            pagetitle = 'ManagerAction_%s' % name
+        elif node.tag == 'application':
+            pagetitle = 'Application_%s' % name
+        elif node.tag == 'function':
+            pagetitle = 'Function_%s' % name
+        elif node.tag == 'agi':
+            pagetitle = 'AGICommand_%s' % name
+        elif node.tag == 'managerEvent':
+            pagetitle = 'ManagerEvent_%s' % name
+        elif node.tag == 'configInfo':
+            pagetitle = 'Configuration_%s' % name
+        if module:
+            pagetitle = '%s_%s' % (pagetitle, module)
+
+        return self.args['prefix'] + pagetitle
+
+    def render(self):
+        ''' Render each element to wiki markup, yielding (page title, tag,
+        wiki) in document order, with the stylesheet or (--renderer=python)
+        wikirender.py.  Rendering is CPU bound, so with --render-jobs
+        the elements are serialized and rendered by a pool of processes,
+        each of which sets up its renderer once. '''
 
+        # Time spent rendering is reported as a phase of its own
+        phase = self.args['renderer'] == 'xslt' and 'xslt' or 'render'
+
+        if self.render_jobs == 1:
+            render_node = renderer(self.args['renderer'], self.xslt,
+                                   self.args['prefix'])
+            for node in self.elements:
+                with self.report.phase(phase):
+                    wiki = render_node(node)
+                yield self.page_title(node), node.tag, wiki
+            return
+
+        # The pool reads ahead on its own thread; the semaphore stops it
+        # from serializing the whole document before anything is published.
+        # Errors on that thread are handed back rather than raised there.
+        chunksize = 16
+        ahead = threading.Semaphore(self.render_jobs * chunksize * 4)
+        stop = threading.Event()
+        failed = []
+
+        def serialized():
+            # Reading the next element can fail too, with --stream, so the
+            # whole loop is covered
+            try:
+                for node in self.elements:
+                    ahead.acquire()
+                    if stop.is_set():
+                        return
+                    yield self.page_title(node), node.tag, \
+                        etree.tostring(node)
+            except Exception:
+                failed.append(sys.exc_info())
+
+        pool = multiprocessing.Pool(self.render_jobs, render_init,
+                                    ('astxml2wiki.xslt', self.args['prefix'],
+                                     self.args['renderer']))
+        try:
+            for page in pool.imap(render, serialized(), chunksize):
+                ahead.release()
+                self.report.add(phase, page[3], page[4])
+                yield page[:3]
+            pool.close()
+        finally:
+            stop.set()
+            ahead.release()
+            pool.terminate()
+            pool.join()
+
+        if failed:
+            raise failed[0][0], failed[0][1], failed[0][2]
+
+    def index_pages(self, topics):
+        ''' List the existing children of each topic parent page, so that
+        publishing can tell a new page from an existing one without a getPage
+        round trip (and a failed one at that) for every element '''
         for f in topics:
-            # Get the ids of the parent pages
-            if f == 'manager':
-                pagetitle = '%sAMI Actions' % self.args['prefix']
-            elif f == 'application':
-                pagetitle = '%sDialplan Applications' % self.args['prefix']
-            elif f == 'function':
-                pagetitle = '%sDialplan Functions' % self.args['prefix']
-            elif f == 'agi':
-                pagetitle = '%sAGI Commands' % self.args['prefix']
-            elif f == 'managerEvent':
-                pagetitle = '%sAMI Events' % self.args['prefix']
-            elif f == 'configInfo':
-                pagetitle = '%sModule Configuration' % self.args['prefix']
-
-            if not pagetitle:
-                print("Unknown topic: %s" % f)
-                raise Exception
+            with self.report.phase('index'):
+                children = self.api.getChildren(str(self.parent[f]))
+            self.children[f] = []
+            for child in children:
+                self.index[child['title']] = self.page_summary(child)
+                self.children[f].append((child['title'], child['id']))
+        if self.args['v'] is True:
+            print "Found %d existing pages" % len(self.index)
 
-            if not self.args['debug']:
-                if self.args['v'] is True:
-                    print "getPage(%s, %s, %s)" % (self.token, self.args['space'], self.parent[f])
+    def page_summary(self, page):
+        ''' The parts of a page (or page summary) the index cares about '''
+        return {
+            'id': page['id'],
+            'version': page.get('version'),
+        }
 
-                try:
-                    elpage = self.api.getPage(
-                        self.token, self.args['space'], self.parent[f])
-                    self.parent[f] = elpage['id']
-                except:
-                    print >>sys.stderr, "Exception getting %s/%s" % (self.args['space'], self.parent[f])
-                    print("Attempting to create %s" % pagetitle)
-                    parentname = "%sCommand Reference" % self.args['prefix']
-                    print("Getting parent %s %s" % (self.args['space'], parentname))
-                    parent = self.api.getPage(self.token, self.args['space'], parentname)
-                    print("Got parent %s %s" % (parent['id'], parent['title']))
-                    newpage = {
-                        'space': self.args['space'],
-                        'parentId': parent['id'],
-                        'title': pagetitle,
-                        'content': "",
-                    }
-                    self.api.storePage(self.token, newpage)
-                    elpage = self.api.getPage(
-                        self.token, self.args['space'], self.parent[f])
-                    self.parent[f] = elpage['id']
-
-        for node in self.elements:
-            name = node.attrib.get('name')
-            module = node.attrib.get('module')
-            if not name:
-                raise ValueError('name undefined for node')
-            if node.tag == 'manager':
-                pagetitle = 'ManagerAction_%s' % name
-            elif node.tag == 'application':
-                pagetitle = 'Application_%s' % name
-            elif node.tag == 'function':
-                pagetitle = 'Function_%s' % name
-            elif node.tag == 'agi':
-                pagetitle = 'AGICommand_%s' % name
-            elif node.tag == 'managerEvent':
-                pagetitle = 'ManagerEvent_%s' % name
-            elif node.tag == 'configInfo':
-                pagetitle = 'Configuration_%s' % name
-            if module:
-                pagetitle = '%s_%s' % (pagetitle, module)
-
-            pagetitle = self.args['prefix'] + pagetitle
-
-            wiki = str(xslt(node))
-            wiki += "\nh3. Import Version\n\n"
-            wiki += ("This documentation was imported from Asterisk Version %s" %
-                (self.ast_v))
-
-            # convert wiki markup to storage format, if needed
-            # Confluence is inconsistent how it renders <br/> tags. ugh.
-            if self.convert:
-                wiki = self.api.convertWikiToStorageFormat(self.token, wiki)
+    def find_page(self, pagetitle):
+        ''' Look up an existing page by title.  Pages that have wandered
+        out from under their parent are found by listing the whole space,
+        which is only done once, and only if something isn't in the index. '''
+        if pagetitle in self.index:
+            return self.index[pagetitle]
+        with self.lock:
+            if self.space_index is None:
+                self.space_index = {}
+                pages = self.api.getPages(self.args['space'])
+                for page in pages:
+                    self.space_index[page['title']] = self.page_summary(page)
+        return self.space_index.get(pagetitle)
 
-            if self.args['debug']:
-                print pagetitle
-                print wiki
+    def publish_worker(self, pages):
+        ''' Publish (or write out) pages from the queue until told to stop.
+        Each item is a method and its arguments.  The first failure is kept
+        so update() can re-raise it once the pool drains. '''
+        while True:
+            page = pages.get()
+            if page is None:
+                return
+            if self.failed:
                 continue
-
             try:
-                oldpage = self.api.getPage(
-                    self.token, self.args['space'], pagetitle
-                )
-                elpage = oldpage.copy()
-
-                elpage['content'] = wiki
-                elpage['title'] = pagetitle
-                elpage['parentId'] = str(self.parent[node.tag])
-                oldcontent = oldpage['content'].split("This documentation was imported from")[0]
-                newcontent = elpage['content'].split("This documentation was imported from")[0]
-
-                # The resulting XML has meaningless inconsistencies.
-                # Hack it into submission.
-                oldcontent = oldcontent.replace("&quot;", '"').replace("<br />", "<br/>").replace('<ul class="alternate">', '<ul class="alternate" type="square">').replace(' class="external-link"', "")
-                newcontent = newcontent.replace("&#35;", "#").replace("&#94;", "^").replace("&#8211;", "&ndash;").replace("&#41;", ")").replace("&#95;", "_").replace(' class="external-link"', "").replace('<br class="atl-forced-newline" />', "")
-
-                if oldcontent != newcontent or self.args['force'] is True:
+                method, args = page
+                if method == self.backend:
+                    started = time.time()
+                    with self.report.phase('publish'):
+                        method(*args)
+                    self.report.page(args[0], time.time() - started)
+                    with self.lock:
+                        self.succeeded.add(args[0])
+                else:
+                    with self.report.phase('reconcile'):
+                        method(*args)
+            except:
+                with self.lock:
+                    if not self.failed:
+                        self.failed = sys.exc_info()
+
+    def write_page(self, pagetitle, wiki, tag):
+        ''' Write a single page to the output directory '''
+        self.output.write(pagetitle, wiki, self.parent[tag])
+        with self.lock:
+            self.processed['created'] += 1
+
+    def convert_wiki(self, wiki):
+        ''' Convert wiki markup to storage format, either locally or on the
+        server.  Server conversions can be recorded, to check the local
+        converter against (see wikiconvert.py). '''
+        with self.report.phase('convert'):
+            if self.args['local-convert'] is True:
+                return wikiconvert.convert(wiki.decode('utf-8'))
+
+            if self.cache:
+                content = self.cache.get(wiki)
+                if content is not None:
+                    return content
+
+            content = self.api.convertWikiToStorageFormat(wiki)
+            if self.cache:
+                self.cache.put(wiki, content)
+            if self.args['record-conversions']:
+                base = os.path.join(self.args['record-conversions'],
+                                    hashlib.sha1(wiki).hexdigest())
+                with open(base + '.wiki', 'w') as f:
+                    f.write(wiki)
+                with open(base + '.xml', 'w') as f:
+                    f.write(content.encode('utf-8'))
+            return content
+
+    def publish(self, pagetitle, wiki, tag):
+        ''' Create or update a single page in Confluence '''
+        key = manifest.Manifest.key(self.args['space'],
+                                    self.args['prefix'], pagetitle)
+        digest = manifest.Manifest.digest(wiki.split(FOOTER)[0])
+
+        # Pages that the run being resumed already published
+        if self.journal and self.journal.done(key, digest):
+            if self.manifest:
+                self.manifest.record(key, digest)
+            with self.lock:
+                self.processed['resumed'] += 1
+            return
+
+        # Pages whose source hasn't changed since they were last published
+        # can be skipped without asking the server, unless we were asked to
+        # check the server's copy anyway.
+        if self.manifest and not self.args['verify-remote'] and \
+            not self.args['force'] is True and \
+            self.manifest.unchanged(key, digest):
+            with self.lock:
+                self.processed['unchanged'] += 1
+            return
+
+        # convert wiki markup to storage format, if needed
+        if self.convert:
+            wiki = self.convert_wiki(wiki)
+
+        summary = self.find_page(pagetitle)
+        if summary is not None:
+            oldpage = self.fetch_page(summary)
+            elpage = oldpage.copy()
+
+            elpage['content'] = wiki
+            elpage['title'] = pagetitle
+            elpage['parentId'] = str(self.parent[tag])
+            oldcontent = oldpage['content'].split(FOOTER)[0]
+            newcontent = elpage['content'].split(FOOTER)[0]
+
+            # The server's copy of the storage format differs from a fresh
+            # conversion in ways that don't matter; see storageformat.py.
+            # Cutting the footer from the text would leave its markup
+            # unbalanced, so the whole pages are given.
+            if self.convert:
+                changed = not storageformat.same(oldpage['content'],
+                                                 elpage['content'], FOOTER)
+            else:
+                changed = oldcontent != newcontent
+
+            if changed or self.args['force'] is True:
+                if not self.args['diff']:
+                    page = self.api.updatePage(elpage, {
+                        'minorEdit': True,
+                        'versionComment': 'Updated to ' + self.ast_v
+                    })
+                    self.published(key, pagetitle, digest, page)
+                with self.lock:
+                    self.processed['updated'] += 1
                     if self.args['v']:
                         print elpage['title'], " updated"
-                        self.processed['updated'] += 1
                     if self.args['diff']:
                         diff = difflib.unified_diff(oldcontent.splitlines(1),
                                                     newcontent.splitlines(1),
                                                     fromfile=pagetitle,
                                                     tofile=pagetitle)
                         for line in diff:
-                            sys.stdout.write(line)
-                    else:
-                        self.api.updatePage(self.token, elpage, {
-                            'minorEdit': True,
-                            'versionComment': 'Updated to ' + self.ast_v
-                        })
-                else:
+                            sys.stdout.write(utf8(line))
+            else:
+                self.published(key, pagetitle, digest, oldpage)
+                with self.lock:
                     self.processed['unchanged'] += 1
-
-            except:
-                newpage['title'] = pagetitle
-                newpage['content'] = wiki
-                newpage['parentId'] = str(self.parent[node.tag])
-                if self.args['diff']:
+        else:
+            newpage = {
+                'space': self.args['space'],
+                'title': pagetitle,
+                'content': wiki,
+                'parentId': str(self.parent[tag]),
+            }
+            if self.args['diff']:
+                with self.lock:
                     print "%s created" % pagetitle
-                else:
-                    try:
-                        page = self.api.storePage(self.token, newpage)
-                        if self.args['v']:
-                            print newpage['title'], " created"
-                            self.processed['created'] += 1
-                    except:
-                        pass
+            else:
+                # A page that can't be created fails the run, as one that
+                # can't be updated does; see publish_worker()
+                page = self.api.storePage(newpage)
+                self.published(key, pagetitle, digest, page)
+                with self.lock:
+                    self.processed['created'] += 1
+                    if self.args['v']:
+                        print newpage['title'], " created"
+
+    def fetch_page(self, summary):
+        ''' Fetch an existing page, from the mirror if it has the version
+        the server lists the page at.  A page listed without a version is
+        always fetched, as the mirrored copy may be out of date. '''
+        version = summary.get('version')
+        if self.mirror and version is not None:
+            page = self.mirror.get(summary['id'], version)
+            if page is not None:
+                self.report.count({'mirrored': 1})
+                return page
+        page = self.api.getPage(summary['id'])
+        if self.mirror:
+            self.mirror.put(page)
+        return page
+
+    def published(self, key, pagetitle, digest, page):
+        ''' Note that a page on the server now matches its source, in the
+        manifest, the journal and the mirror '''
+        if self.manifest:
+            self.manifest.record(key, digest)
+        if self.journal:
+            self.journal.record(key, pagetitle, digest, page.get('version'))
+        if self.mirror:
+            self.mirror.put(page)
+
+
+class StubServer:
+    ''' Stands in for Confluence, holding one page '''
+    def __init__(self, content):
+        self.page = {'id': '1', 'version': '3', 'content': content}
+        self.updated = []
+
+    def getPage(self, page_id):
+        return dict(self.page)
+
+    def updatePage(self, page, options):
+        self.updated.append(page)
+        return page
+
+    def getPages(self, space):
+        return []
+
+    def storePage(self, page):
+        raise xmlrpclib.Fault(0, 'Could not create %s' % page['title'])
+
+
+class PublishTests(unittest.TestCase):
+    TITLE = 'Asterisk 13 Application_Foo'
+    WIKI = 'h1. Synopsis\n\nSets "x" to {{y}}.\n\nh3. Import Version\n\n' \
+        '%s Asterisk Version 13.1.0' % FOOTER
+
+    def publish(self, content, title=TITLE):
+        docs = AstXML2Wiki(['astxml2wiki.py', '--debug', '--local-convert',
+                            '--file=%s' % os.devnull, '--report=',
+                            '--prefix=Asterisk 13 '])
+        docs.api = StubServer(content)
+        docs.index = {self.TITLE: {'id': '1', 'version': '3'}}
+        docs.parent = {'application': '2'}
+        docs.publish(title, self.WIKI, 'application')
+        return docs
+
+    def test_footer(self):
+        # The server writes the quotes as they are, and the page was last
+        # imported from another version
+        docs = self.publish('<h1>Synopsis</h1><p>Sets "x" to <code>y</code>.'
+                            '</p><h3>Import Version</h3><p>%s Asterisk '
+                            'Version 13.0.0</p>' % FOOTER)
+        self.assertEqual(docs.api.updated, [])
+        self.assertEqual(docs.processed['unchanged'], 1)
+
+    def test_changed(self):
+        docs = self.publish('<h1>Synopsis</h1><p>Sets "z" to <code>y</code>.'
+                            '</p><h3>Import Version</h3><p>%s Asterisk '
+                            'Version 13.1.0</p>' % FOOTER)
+        self.assertEqual(len(docs.api.updated), 1)
+        self.assertEqual(docs.processed['updated'], 1)
+
+    def test_create_fails(self):
+        # The page isn't on the server, and the server won't create it
+        self.assertRaises(xmlrpclib.Fault, self.publish, '',
+                          'Asterisk 13 Application_Bar')
+
+
+class FingerprintTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'fingerprints.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_failed_publish(self):
+        docs = AstXML2Wiki(['astxml2wiki.py', '--debug',
+                            '--file=%s' % os.devnull, '--report=',
+                            '--prefix=Asterisk 13',
+                            '--save-fingerprints=%s' % self.path])
+        docs.args['debug'] = False
+        docs.previous = {'application/Foo/': 'old', 'application/Bar/': 'old',
+                         'application/Same/': 'same'}
+        docs.prints = {'application/Foo/': 'new', 'application/Bar/': 'new',
+                       'application/Baz/': 'new', 'application/Same/': 'same'}
+        # Only Foo was published; Bar and Baz failed, Same wasn't changed
+        docs.succeeded = set([docs.key_title('application/Foo/')])
+        docs.save_fingerprints()
+        self.assertEqual(
+            fingerprints.load(self.path, docs.topics, docs.rendered),
+            {'application/Foo/': 'new', 'application/Bar/': 'old',
+             'application/Same/': 'same'})
+        # Pages rendered some other way have to be published again
+        self.assertEqual(fingerprints.load(self.path, docs.topics, 'other'),
+                         {})
 
 
 def main(argv):
@@ -444,10 +1238,15 @@ def main(argv):
     '''
 
     a = AstXML2Wiki(argv)
-    if a.args['svn'] != '':
-        a.build()
+    try:
+        if a.args['svn'] != '':
+            a.build()
 
-    a.parse()
+        a.parse()
+    except:
+        # update() saves what it did itself, however it stops
+        a.close(False)
+        raise
 
     a.update()
     if a.args['debug']:
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""Synthetic Documentation Generator
+
+Writes an asterisk-docs.xml lookalike with any number of documented elements,
+for benchmarking astxml2wiki.py without building Asterisk.  The elements are
+spread over all of the documented types, with paragraphs full of inline
+markup, option lists, enum lists, see-also references and, for configInfo,
+deeply nested config objects and options.  It can also write ARI .wiki pages
+for publish-rest-api.py.  The output only depends on the arguments.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import os
+import random
+import sys
+from optparse import OptionParser
+
+from xml.sax.saxutils import escape, quoteattr
+
+TOPICS = ['application', 'function', 'manager', 'managerEvent', 'agi',
+          'configInfo']
+
+WORDS = ('the channel call bridge dialplan variable option value device '
+         'endpoint extension context priority timeout module driver media '
+         'codec caller called party answer hangup queue member state '
+         'status transfer park voicemail mailbox conference announcement '
+         'prompt digits sound file header event action response').split()
+
+MARKUP = ['literal', 'replaceable', 'variable', 'filename', 'emphasis',
+          'directory']
+
+
+class Generator:
+    """Builds the documentation, one element at a time."""
+
+    def __init__(self, seed, markup, depth):
+        """Keyword Arguments:
+        seed -- Seeds the random choices, so a corpus can be regenerated.
+        markup -- How many inline markup elements each paragraph has.
+        depth -- How many config objects each configInfo has.
+        """
+        self.random = random.Random(seed)
+        self.markup = markup
+        self.depth = depth
+
+    def words(self, count):
+        return ' '.join(self.random.choice(WORDS) for i in range(count))
+
+    def para(self):
+        """A paragraph with inline markup, and the odd character that has to
+        be escaped in wiki markup."""
+        out = [escape(self.words(6)).capitalize()]
+        for i in range(self.markup):
+            tag = self.random.choice(MARKUP)
+            out.append('<%s>%s</%s>' % (tag, self.words(1).upper(), tag))
+            out.append(escape(self.words(5)))
+        out.append('[optional] {braces} and_underscores.')
+        return '<para>%s</para>' % ' '.join(out)
+
+    def parameters(self, count):
+        out = ['<syntax argsep=",">']
+        for i in range(count):
+            out.append('<parameter name="param%d" required="%s">' % (
+                i, i == 0 and 'true' or 'false'))
+            out.append(self.para())
+            if i == count - 1:
+                out.append('<optionlist>')
+                for name in 'abcd':
+                    out.append('<option name="%s" argsep=":">' % name)
+                    out.append('<argument name="arg" required="true">'
+                               '%s</argument>' % self.para())
+                    out.append(self.para())
+                    out.append('</option>')
+                out.append('</optionlist>')
+            out.append('</parameter>')
+        out.append('</syntax>')
+        return ''.join(out)
+
+    def description(self):
+        out = ['<description>']
+        for i in range(3):
+            out.append(self.para())
+        out.append('<variablelist><variable name="STATUS">%s' % self.para())
+        for value in ['SUCCESS', 'FAILURE', 'HANGUP']:
+            out.append('<value name="%s">%s</value>' % (value,
+                                                        self.words(4)))
+        out.append('</variable></variablelist>')
+        out.append('<enumlist>')
+        for name in ['first', 'second', 'third']:
+            out.append('<enum name="%s">%s</enum>' % (name, self.para()))
+        out.append('</enumlist>')
+        out.append('<note>%s</note>' % self.para())
+        out.append('<example title="Example">exten =&gt; s,1,NoOp(%s)'
+                   '</example>' % self.words(2))
+        out.append('</description>')
+        return ''.join(out)
+
+    def see_also(self, n):
+        out = ['<see-also>']
+        for i in range(3):
+            tag = self.random.choice(TOPICS[:5])
+            out.append('<ref type="%s">%s</ref>' % (tag, self.name(tag, n + i)))
+        out.append('<ref type="filename">bench.conf</ref>')
+        out.append('</see-also>')
+        return ''.join(out)
+
+    def name(self, tag, n):
+        if tag == 'agi':
+            return 'bench command %d' % n
+        if tag == 'function':
+            return 'BENCH_FUNC%d' % n
+        return 'Bench%s%d' % (tag[0].upper() + tag[1:], n)
+
+    def element(self, n):
+        """The n'th documented element"""
+        tag = TOPICS[n % len(TOPICS)]
+        name = quoteattr(self.name(tag, n))
+        module = ' module="bench_%d"' % n if n % 3 == 0 else ''
+        synopsis = '<synopsis>%s</synopsis>' % escape(self.words(8))
+
+        if tag == 'managerEvent':
+            return ('<managerEvent language="en_US" name=%s>'
+                    '<managerEventInstance class="EVENT_FLAG_CALL">%s%s%s'
+                    '</managerEventInstance></managerEvent>' % (
+                        name, synopsis, self.parameters(4), self.see_also(n)))
+
+        if tag == 'configInfo':
+            out = ['<configInfo name=%s language="en_US">%s' % (name, synopsis),
+                   '<description>%s</description>' % self.para(),
+                   '<configFile name="bench%d.conf">' % n]
+            for i in range(self.depth):
+                out.append('<configObject name="object%d">'
+                           '<synopsis>%s</synopsis>'
+                           '<description>%s</description>' % (
+                               i, self.words(4), self.para()))
+                for j in range(6):
+                    out.append('<configOption name="option%d" default="%s">'
+                               '<synopsis>%s</synopsis>'
+                               '<description>%s<enumlist><enum name="yes"/>'
+                               '<enum name="no"/></enumlist></description>'
+                               '</configOption>' % (
+                                   j, self.random.choice(['yes', 'no']),
+                                   self.words(5), self.para()))
+                out.append('</configObject>')
+            out.append('</configFile></configInfo>')
+            return ''.join(out)
+
+        return '<%s name=%s language="en_US"%s>%s%s%s%s</%s>' % (
+            tag, name, module, synopsis, self.parameters(4),
+            self.description(), self.see_also(n), tag)
+
+    def write_docs(self, path, count):
+        """Write a documentation file with count elements."""
+        f = open(path, 'w')
+        try:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<docs xmlns:xi="http://www.w3.org/2001/XInclude">\n')
+            for n in range(count):
+                f.write(self.element(n))
+                f.write('\n')
+            f.write('</docs>\n')
+        finally:
+            f.close()
+
+    def write_ari(self, directory, prefix, count):
+        """Write count ARI resource pages, as make ari-stubs would."""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for n in range(count):
+            out = ['{toc}\n\nh1. Bench%d\n' % n,
+                   '|| Method || Path || Return Model || Summary ||']
+            for i in range(8):
+                out.append('| GET | [/bench%d/\\{id\\}/op%d|#op%d] | '
+                           '[Bench%d] | %s |' % (n, i, i, n, self.words(5)))
+            for i in range(8):
+                out.append('\n{anchor:op%d}\nh2. op%d: GET /bench%d/\\{id\\}'
+                           '\n%s\n\nh3. Path parameters\n* id: string - %s\n'
+                           % (i, i, n, self.words(20), self.words(6)))
+            f = open(os.path.join(directory, '%s Bench%d REST API.wiki' %
+                                  (prefix, n)), 'w')
+            try:
+                f.write('\n'.join(out))
+            finally:
+                f.close()
+
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options] OUTPUT.xml")
+    parser.add_option("--elements", type="int", default=1000,
+                      help="Documented elements to generate")
+    parser.add_option("--markup", type="int", default=6,
+                      help="Inline markup elements per paragraph")
+    parser.add_option("--depth", type="int", default=8,
+                      help="Config objects per configInfo")
+    parser.add_option("--seed", type="int", default=0,
+                      help="Seed for the random choices")
+    parser.add_option("--ari", type="int", default=0,
+                      help="Also write this many ARI pages to --ari-dir")
+    parser.add_option("--ari-dir", default="doc/rest-api",
+                      help="Where to write the ARI pages")
+    parser.add_option("--prefix", default="Asterisk Bench",
+                      help="Prefix of the ARI page titles")
+    (options, args) = parser.parse_args(argv)
+
+    if len(args) != 2:
+        parser.error("Wrong number of arguments")
+
+    generator = Generator(options.seed, options.markup, options.depth)
+    generator.write_docs(args[1], options.elements)
+    if options.ari:
+        generator.write_ari(options.ari_dir, options.prefix, options.ari)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Mock Confluence Server
+
+A stand-in for Confluence's XML-RPC API, for benchmarking the publishing
+scripts without a wiki.  It keeps pages in memory and implements the calls
+the scripts make, under both the confluence1 and confluence2 APIs, with an
+optional delay on every call to simulate a remote server.  Wiki markup is
+converted with wikiconvert.py.
+
+Pages whose title ends in "Command Reference" are created when they are first
+asked for, as the scripts expect them to exist already.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import os
+import sys
+import threading
+import time
+import xmlrpclib
+from optparse import OptionParser
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wikiconvert
+
+
+class API:
+    """The calls made by the publishing scripts."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.titles = {}
+        self.next_id = 100
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def store(self, page):
+        with self.lock:
+            page = dict(page)
+            if 'id' not in page:
+                self.next_id += 1
+                page['id'] = str(self.next_id)
+            page['version'] = str(int(page.get('version', 0)) + 1)
+            page.setdefault('parentId', '0')
+            self.pages[page['id']] = page
+            self.titles[(page['space'], page['title'])] = page['id']
+            return dict(page)
+
+    def summary(self, page):
+        # As Confluence's PageSummary, which has no version
+        summary = dict((k, page[k]) for k in ['id', 'space', 'title',
+                                              'parentId'])
+        summary['url'] = '/pages/viewpage.action?pageId=%s' % page['id']
+        summary['permissions'] = '0'
+        return summary
+
+    def login(self, username, password):
+        self.delay()
+        return 'token-%s' % username
+
+    def getPage(self, token, *args):
+        self.delay()
+        if len(args) == 1:
+            page_id = args[0]
+        else:
+            page_id = self.titles.get(tuple(args))
+            if page_id is None and args[1].endswith('Command Reference'):
+                return self.store({'space': args[0], 'title': args[1],
+                                   'content': ''})
+        if page_id not in self.pages:
+            raise xmlrpclib.Fault(0, 'No page %s' % (args,))
+        return dict(self.pages[page_id])
+
+    def storePage(self, token, page):
+        self.delay()
+        if (page['space'], page['title']) in self.titles:
+            raise xmlrpclib.Fault(0, 'Page %s already exists' % page['title'])
+        return self.store(page)
+
+    def updatePage(self, token, page, options):
+        self.delay()
+        if page.get('id') not in self.pages:
+            raise xmlrpclib.Fault(0, 'No page %s' % page.get('id'))
+        return self.store(page)
+
+    def getChildren(self, token, page_id):
+        self.delay()
+        return [self.summary(p) for p in self.pages.values()
+                if p['parentId'] == page_id]
+
+    def getPages(self, token, space):
+        self.delay()
+        return [self.summary(p) for p in self.pages.values()
+                if p['space'] == space]
+
+    def convertWikiToStorageFormat(self, token, wiki):
+        self.delay()
+        return wikiconvert.convert(wiki)
+
+    def addLabelByName(self, token, label, page_id):
+        self.delay()
+        return True
+
+    def movePage(self, token, page_id, target_id, position):
+        self.delay()
+        with self.lock:
+            self.pages[page_id]['parentId'] = target_id
+        return True
+
+
+class Namespaces:
+    def __init__(self, api):
+        self.confluence1 = api
+        self.confluence2 = api
+
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class Handler(SimpleXMLRPCRequestHandler):
+    # Answer on any path, such as /rpc/xmlrpc
+    rpc_paths = ()
+
+    def log_message(self, *args):
+        pass
+
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--port", type="int", default=8090,
+                      help="Port to listen on")
+    parser.add_option("--latency", type="float", default=0,
+                      help="Seconds to delay every call by")
+    (options, args) = parser.parse_args(argv)
+
+    server = Server(('127.0.0.1', options.port), Handler, logRequests=False,
+                    allow_none=True)
+    server.register_instance(Namespaces(API(options.latency)),
+                             allow_dotted_names=True)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Paragraph Benchmark
+
+Checks and times the first pass astxml2wiki.py makes over each element,
+build_paragraph_contents(), which rebuilds every <para> as wiki markup.  A
+set of paragraphs with known wiki markup is checked first: markup with the
+same text as other markup or as plain text, paragraphs starting with markup,
+nested markup and characters that need escaping.  Then paragraphs with more
+and more markup in them are timed; the time per piece of markup should stay
+about the same however many there are.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+import lxml.etree as etree
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.dirname(BENCH)
+
+sys.path.insert(0, TOPDIR)
+
+import astxml2wiki
+
+# (paragraph, the wiki markup it becomes)
+CASES = [
+    ('<para>Set <literal>x</literal> or <emphasis>x</emphasis>.</para>',
+     'Set {{x}} or *x*.'),
+    ('<para>Either <literal>yes</literal>yes</para>',
+     'Either {{yes}}yes'),
+    ('<para><replaceable>name</replaceable> is the name.</para>',
+     '_name_ is the name.'),
+    ('<para>Use <variable>${VAR}</variable> [opt]</para>',
+     'Use {{$\\{VAR\\}}} \\[opt\\]'),
+    ('<para>See <emphasis>the <filename>file</filename> here</emphasis> '
+     'now</para>',
+     'See *the *file here now'),
+    ('<para>One\n\ttwo <astcli>core show help</astcli></para>',
+     'One two {{core show help}}'),
+]
+
+TAGS = ['filename', 'emphasis', 'literal', 'replaceable']
+
+
+def element(paragraph):
+    """An application documented by one paragraph"""
+    return etree.fromstring('<application name="Bench"><description>%s'
+                            '</description></application>' % paragraph)
+
+
+def paragraph(count):
+    """A paragraph with count pieces of markup in it, many with the same
+    text"""
+    para = etree.Element('para')
+    para.text = 'Starts here '
+    for i in range(count):
+        markup = etree.SubElement(para, TAGS[i % len(TAGS)])
+        markup.text = 'value%d' % (i % 10)
+        markup.tail = ' and value%d, ' % (i % 7)
+    return etree.tostring(para)
+
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--markup", default="100,1000,10000",
+                      help="Comma separated numbers of pieces of markup per "
+                      "paragraph")
+    parser.add_option("--paragraphs", type="int", default=10,
+                      help="Paragraphs to time for each count")
+    (options, args) = parser.parse_args(argv)
+
+    # The stylesheet is read from the current directory.  The paragraphs
+    # are given to build_paragraph_contents() directly, so no documentation
+    # file is read.
+    os.chdir(TOPDIR)
+    docs = astxml2wiki.AstXML2Wiki(['astxml2wiki.py', '--debug',
+                                    '--file=%s' % os.devnull, '--report='])
+
+    wrong = 0
+    for source, expected in CASES:
+        node = docs.build_paragraph_contents(element(source))
+        text = node.find('description/para').text
+        if text != expected:
+            print "%s\n    gives    %r\n    expected %r" % (source, text,
+                                                             expected)
+            wrong += 1
+    print "%d of %d paragraphs rendered as expected" % (len(CASES) - wrong,
+                                                        len(CASES))
+
+    for count in [int(count) for count in options.markup.split(',')]:
+        nodes = [element(paragraph(count))
+                 for i in range(options.paragraphs)]
+        started = time.time()
+        for node in nodes:
+            docs.build_paragraph_contents(node)
+        seconds = time.time() - started
+        print "%6d pieces of markup %10.2f ms per paragraph %8.2f us each" % (
+            count, seconds * 1000 / len(nodes),
+            seconds * 1000000 / len(nodes) / count)
+    return wrong and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)
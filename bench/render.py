@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Rendering Benchmark
+
+Times rendering applications and functions with many parameters to wiki
+markup, with astxml2wiki.xslt and with wikirender.py, for a range of
+parameter counts.  The syntax line of an element is built from all of its
+parameters and their arguments, so this is where rendering time grows with
+the size of an element.  Given another stylesheet with --compare (an earlier
+astxml2wiki.xslt, say), it times that too, and checks that every element is
+rendered the same by all of them.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import os
+import random
+import sys
+import time
+from optparse import OptionParser
+
+import lxml.etree as etree
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.dirname(BENCH)
+
+sys.path.insert(0, TOPDIR)
+
+import wikirender
+
+REQUIRED = [None, 'true', 'yes', 'false', 'no']
+
+
+def element(rand, tag, index, count):
+    """An element with count parameters, some of them with arguments, and
+    a random mix of the attributes the syntax depends on."""
+    node = etree.Element(tag, name='Bench%d' % index, language='en_US')
+    etree.SubElement(node, 'synopsis').text = 'Takes %d parameters.' % count
+    syntax = etree.SubElement(node, 'syntax')
+    if rand.random() < 0.5:
+        syntax.set('argsep', rand.choice([',', ':', '|']))
+    for i in range(count):
+        parameter = etree.SubElement(syntax, 'parameter', name='param%d' % i)
+        if rand.choice(REQUIRED):
+            parameter.set('required', rand.choice(REQUIRED[1:]))
+        if rand.random() < 0.2:
+            parameter.set('multiple', 'true')
+        etree.SubElement(parameter, 'para').text = 'Parameter %d.' % i
+        if rand.random() < 0.25:
+            if rand.random() < 0.5:
+                parameter.set('hasparams', rand.choice(['true', 'optional']))
+            if rand.random() < 0.5:
+                parameter.set('argsep', '&')
+            for j in range(rand.randint(1, 4)):
+                argument = etree.SubElement(parameter, 'argument',
+                                            name='arg%d' % j)
+                if rand.choice(REQUIRED):
+                    argument.set('required', rand.choice(REQUIRED[1:]))
+                if rand.random() < 0.2:
+                    argument.set('multiple', 'yes')
+    return node
+
+
+def timed(render, nodes):
+    """Render the nodes, returning the output and how long it took."""
+    started = time.time()
+    output = [render(node) for node in nodes]
+    return output, time.time() - started
+
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--parameters", default="10,100,1000,5000",
+                      help="Comma separated numbers of parameters per element")
+    parser.add_option("--elements", type="int", default=10,
+                      help="Elements of each type to render for each count")
+    parser.add_option("--compare", action="append", default=[],
+                      help="Also time this stylesheet, and check that it "
+                      "renders the same; may be given more than once")
+    parser.add_option("--seed", type="int", default=0,
+                      help="Seed for the random choices")
+    (options, args) = parser.parse_args(argv)
+
+    prefix = 'Asterisk Bench '
+    stylesheets = [os.path.join(TOPDIR, 'astxml2wiki.xslt')] + options.compare
+    renderers = []
+    for path in stylesheets:
+        xslt = etree.XSLT(etree.parse(path))
+        renderers.append((os.path.relpath(path),
+                          lambda node, xslt=xslt: str(xslt(
+                              node, prefix=etree.XSLT.strparam(prefix)))))
+    renderers.append(('wikirender.py', wikirender.Renderer(prefix).render))
+
+    rand = random.Random(options.seed)
+    different = 0
+    for count in [int(count) for count in options.parameters.split(',')]:
+        nodes = [element(rand, tag, i, count)
+                 for tag in ['application', 'function']
+                 for i in range(options.elements)]
+        expected = None
+        for name, render in renderers:
+            output, seconds = timed(render, nodes)
+            print "%6d parameters %-30s %10.2f ms per element" % (
+                count, name, seconds * 1000 / len(nodes))
+            sys.stdout.flush()
+            if expected is None:
+                expected = output
+            elif output != expected:
+                print "%s renders %d of %d elements differently" % (
+                    name, len([a for a, b in zip(expected, output) if a != b]),
+                    len(nodes))
+                different += 1
+    return different and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)
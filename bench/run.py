@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""Publishing Benchmark
+
+Measures how fast astxml2wiki.py and publish-rest-api.py publish, and how
+much memory they use, against the mock Confluence server (mockconfluence.py)
+and synthetic documentation (gendocs.py).  For each corpus size, and for a
+set of ARI pages, it times:
+
+    create  - publishing every page for the first time
+    verify  - publishing them all again, comparing each with the server's
+              copy (the manifest is turned off, so nothing is skipped)
+
+and reports pages per second and the peak RSS of the script.  Results can
+be saved, and compared with a saved baseline to catch regressions.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.dirname(BENCH)
+
+
+def free_port():
+    """A port nothing is listening on."""
+    s = socket.socket()
+    try:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+def wait_for(port, timeout=10):
+    """Wait until the mock server accepts connections."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def measure(args, cwd, report):
+    """Run a script, returning its wall clock time, peak RSS in KiB and the
+    number of pages it published (from its run report)."""
+    log = '%s.log' % report
+    started = time.time()
+    with open(os.devnull, 'w') as devnull:
+        with open(log, 'w') as errors:
+            process = subprocess.Popen(args, cwd=cwd, stdout=devnull,
+                                       stderr=errors,
+                                       env=dict(os.environ,
+                                                CONFLUENCE_PASSWORD='bench'))
+            pid, status, usage = os.wait4(process.pid, 0)
+    wall = time.time() - started
+    if status != 0:
+        with open(log) as errors:
+            sys.stderr.write(errors.read())
+        raise RuntimeError("%s failed (%d)" % (' '.join(args), status))
+
+    with open(report) as f:
+        counts = json.load(f)['counts']
+    pages = sum(counts.get(k, 0) for k in ['created', 'updated', 'unchanged'])
+    return wall, usage.ru_maxrss, pages
+
+
+def run(options, workdir, port):
+    server = 'http://127.0.0.1:%d/rpc/xmlrpc' % port
+    report = os.path.join(workdir, 'report.json')
+    results = []
+
+    def record(script, size, scenario, measured):
+        wall, rss, pages = measured
+        results.append({
+            'script': script,
+            'size': size,
+            'scenario': scenario,
+            'pages': pages,
+            'seconds': wall,
+            'pages_per_second': pages / wall,
+            'peak_rss_kib': rss,
+        })
+        print "%-20s %6d %-7s %6d pages %8.2fs %8.1f pages/s %8.1f MiB" % (
+            script, size, scenario, pages, wall, pages / wall, rss / 1024.0)
+        sys.stdout.flush()
+
+    for size in options.sizes:
+        docs = os.path.join(workdir, 'docs-%d.xml' % size)
+        subprocess.check_call([sys.executable,
+                               os.path.join(BENCH, 'gendocs.py'),
+                               '--elements=%d' % size, docs])
+        args = [sys.executable, os.path.join(TOPDIR, 'astxml2wiki.py'),
+                '--username=bench', '--password=bench',
+                '--server=%s' % server,
+                '--prefix=Bench %d' % size,
+                '--file=%s' % docs,
+                '--jobs=%d' % options.jobs,
+                '--render-jobs=%d' % options.render_jobs,
+                '--manifest=', '--conversion-cache=',
+                '--report=%s' % report]
+        for scenario in ['create', 'verify']:
+            record('astxml2wiki.py', size, scenario,
+                   measure(args, TOPDIR, report))
+
+    if options.ari:
+        prefix = 'Bench ARI'
+        aridir = os.path.join(workdir, 'ari')
+        subprocess.check_call([sys.executable,
+                               os.path.join(BENCH, 'gendocs.py'),
+                               '--elements=0', '--ari=%d' % options.ari,
+                               '--ari-dir=%s' % os.path.join(aridir, 'doc',
+                                                             'rest-api'),
+                               '--prefix=%s' % prefix,
+                               os.path.join(workdir, 'empty.xml')])
+        args = [sys.executable, os.path.join(TOPDIR, 'publish-rest-api.py'),
+                '--username=bench', '--jobs=%d' % options.jobs,
+                '--manifest=', '--conversion-cache=',
+                '--report=%s' % report, server, 'AST', prefix]
+        for scenario in ['create', 'verify']:
+            record('publish-rest-api.py', options.ari, scenario,
+                   measure(args, aridir, report))
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Report results that are slower than the baseline by more than the
+    tolerance; returns whether there were any."""
+    expected = dict(((r['script'], r['size'], r['scenario']),
+                     r['pages_per_second']) for r in baseline)
+    regressed = False
+    for r in results:
+        before = expected.get((r['script'], r['size'], r['scenario']))
+        if before and r['pages_per_second'] < before * (1 - tolerance):
+            print "Regression: %s %d %s: %.1f pages/s, was %.1f" % (
+                r['script'], r['size'], r['scenario'],
+                r['pages_per_second'], before)
+            regressed = True
+    return regressed
+
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--sizes", default="1000,5000",
+                      help="Comma separated numbers of elements to publish")
+    parser.add_option("--ari", type="int", default=50,
+                      help="ARI pages to publish; 0 to skip")
+    parser.add_option("--jobs", type="int", default=4,
+                      help="--jobs for the scripts")
+    parser.add_option("--render-jobs", type="int", default=1,
+                      help="--render-jobs for astxml2wiki.py")
+    parser.add_option("--latency", type="float", default=0.005,
+                      help="Seconds the mock server delays each call by")
+    parser.add_option("--save", help="Write the results to this JSON file")
+    parser.add_option("--baseline",
+                      help="Compare with results saved by --save")
+    parser.add_option("--tolerance", type="float", default=0.25,
+                      help="How much slower than the baseline is a regression")
+    parser.add_option("--keep", action="store_true", default=False,
+                      help="Keep the generated files, and print where")
+    (options, args) = parser.parse_args(argv)
+
+    options.sizes = [int(size) for size in options.sizes.split(',')]
+
+    workdir = tempfile.mkdtemp(prefix='publish-bench.')
+    port = free_port()
+    mock = subprocess.Popen([sys.executable,
+                             os.path.join(BENCH, 'mockconfluence.py'),
+                             '--port=%d' % port,
+                             '--latency=%s' % options.latency])
+    try:
+        wait_for(port)
+        results = run(options, workdir, port)
+    finally:
+        mock.terminate()
+        mock.wait()
+        if options.keep:
+            print "Files kept in %s" % workdir
+        else:
+            shutil.rmtree(workdir)
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as f:
+            if compare(results, json.load(f), options.tolerance):
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)
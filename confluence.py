@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Confluence XML-RPC Client
+
+This module wraps the Confluence XML-RPC API for the publishing scripts.
+Calls are made over a pool of persistent connections that can be shared
+between threads.  Calls that are safe to repeat are retried, with capped
+exponential backoff, when the connection fails.  The rate of calls can also
+be limited for the whole run, and the calls can be recorded in a run report
+(see runreport.py).  If the session expires part way through a run, the
+client logs in again and repeats the call.
+
+Methods are called without the session token, which the client supplies:
+
+    api = confluence.Confluence(url)
+    api.login(username, password)
+    page = api.getPage(space, title)
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import httplib
+import Queue
+import re
+import socket
+import threading
+import time
+import xmlrpclib
+
+# Calls that don't change anything on the server, so can safely be repeated
+IDEMPOTENT = [
+    'getPage',
+    'getPages',
+    'getChildren',
+    'getPageSummary',
+    'getSpace',
+    'convertWikiToStorageFormat',
+]
+
+# Failures that are worth retrying, as opposed to the server refusing a call
+TRANSIENT = (socket.error, httplib.HTTPException, xmlrpclib.ProtocolError)
+
+# How the server says the session token is no longer any good
+EXPIRED = re.compile(r'InvalidSessionException|session expired', re.I)
+
+
+class Counting:
+    """Counts the bytes a transport sends and receives."""
+
+    sent = 0
+    received = 0
+
+    def send_content(self, connection, request_body):
+        self.sent += len(request_body)
+        return xmlrpclib.Transport.send_content(self, connection,
+                                                request_body)
+
+    def parse_response(self, response):
+        read = response.read
+
+        def counting_read(*args):
+            data = read(*args)
+            self.received += len(data)
+            return data
+        response.read = counting_read
+        return xmlrpclib.Transport.parse_response(self, response)
+
+
+class CountingTransport(Counting, xmlrpclib.Transport):
+    pass
+
+
+class CountingSafeTransport(Counting, xmlrpclib.SafeTransport):
+    pass
+
+
+class Confluence:
+    """A Confluence XML-RPC client.
+
+    Any method of the server's API can be called on the client; see the
+    module documentation.
+    """
+
+    def __init__(self, url, connections=1, retries=5, rate=0, report=None):
+        """Create a client.  No connection is made until the first call.
+
+        Keyword Arguments:
+        url -- The URL of the server's XML-RPC endpoint.
+        connections -- The most connections to keep open to the server.
+        retries -- How many times to retry a failed idempotent call.
+        rate -- The most calls to make per second; 0 for no limit.
+        report -- A runreport.Report to record the calls in.
+        """
+        self.url = url
+        self.retries = retries
+        self.report = report
+        self.interval = rate and 1.0 / rate or 0
+        self.token = ''
+        self.version = 'confluence1'
+        self.credentials = None
+        self.login_lock = threading.Lock()
+
+        self.lock = threading.Lock()
+        self.next_call = 0
+        self.pool = Queue.Queue()
+        self.available = threading.Semaphore(connections)
+
+    def login(self, username, password):
+        """Log in, preferring the version 2 API, and return the token."""
+        self.credentials = (username, password)
+        try:
+            self.version = 'confluence2'
+            self.token = self.call('login', username, password, token=False)
+        except xmlrpclib.Error:
+            self.version = 'confluence1'
+            self.token = self.call('login', username, password, token=False)
+        return self.token
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args: self.call(method, *args)
+
+    def call(self, method, *args, **kwargs):
+        """Call an API method, passing the session token first unless
+        token=False is given."""
+        if not kwargs.get('token', True):
+            return self.send(method, args)
+
+        token = self.token
+        try:
+            return self.send(method, (token,) + args)
+        except xmlrpclib.Fault, e:
+            if self.credentials is None or not EXPIRED.search(e.faultString):
+                raise
+        self.relogin(token)
+        return self.send(method, (self.token,) + args)
+
+    def relogin(self, expired):
+        """Replace an expired token, unless another thread already has."""
+        with self.login_lock:
+            if self.token == expired:
+                self.token = self.send('login', self.credentials)
+
+    def send(self, method, args):
+        """Make a call over a pooled connection, retrying it if it's safe
+        to."""
+        self.available.acquire()
+        try:
+            server = self.connection()
+            attempt = 0
+            while True:
+                self.throttle()
+                proxy, transport = server
+                sent, received = transport.sent, transport.received
+                started = time.time()
+                failed = True
+                try:
+                    result = getattr(getattr(proxy, self.version),
+                                     method)(*args)
+                    failed = False
+                    break
+                except xmlrpclib.Fault:
+                    # The server refused the call; the connection is fine
+                    self.pool.put(server)
+                    raise
+                except TRANSIENT:
+                    # The connection is in an unknown state; start over
+                    server = self.connection(fresh=True)
+                    if method not in IDEMPOTENT or attempt >= self.retries:
+                        raise
+                    time.sleep(min(30, 0.5 * 2 ** attempt))
+                    attempt += 1
+                finally:
+                    if self.report:
+                        self.report.call(method, time.time() - started,
+                                         transport.sent - sent,
+                                         transport.received - received,
+                                         failed)
+            self.pool.put(server)
+            return result
+        finally:
+            self.available.release()
+
+    def connection(self, fresh=False):
+        """Take an open connection from the pool, or make a new one.
+        Connections are kept as (proxy, transport) pairs."""
+        if not fresh:
+            try:
+                return self.pool.get_nowait()
+            except Queue.Empty:
+                pass
+        if self.url.startswith('https:'):
+            transport = CountingSafeTransport()
+        else:
+            transport = CountingTransport()
+        return xmlrpclib.ServerProxy(self.url, transport), transport
+
+    def throttle(self):
+        """Wait until the rate limit allows another call."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            wait = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if wait > 0:
+            time.sleep(wait)
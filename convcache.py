@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Conversion Cache
+
+This module keeps the storage format Confluence produced for a piece of wiki
+markup, so the same markup doesn't have to be sent back to the server for
+conversion on every run.  Entries are keyed by a hash of the server and the
+markup, and the least recently used ones are evicted once the cache grows
+past its size limit.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+# Shared by all of the publishing scripts, whichever directory they run from
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'conversion-cache.db')
+
+DEFAULT_SIZE = 20000
+
+
+class ConversionCache:
+    """An on-disk, size-bounded cache of wiki markup conversions."""
+
+    def __init__(self, path, server, size=DEFAULT_SIZE):
+        """Open (or create) a conversion cache.
+
+        Keyword Arguments:
+        path -- The SQLite database the cache is kept in.
+        server -- Identifies the server doing the conversions, usually its URL.
+        size -- The most entries to keep.
+        """
+        self.server = server
+        self.size = size
+        self.lock = threading.Lock()
+        # Writes are kept until close(), so that another script using the
+        # cache at the same time isn't locked out of it for the whole run
+        self.pending = {}
+        self.touched = {}
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS conversions '
+                        '(key TEXT PRIMARY KEY, content TEXT, used INTEGER)')
+        self.used = self.db.execute(
+            'SELECT COALESCE(MAX(used), 0) FROM conversions').fetchone()[0]
+
+    def key(self, wiki):
+        """Hash the markup, along with the server converting it."""
+        if isinstance(wiki, unicode):
+            wiki = wiki.encode('utf-8')
+        return hashlib.sha1('%s\0%s' % (self.server, wiki)).hexdigest()
+
+    def get(self, wiki):
+        """Look up the conversion of some markup, or None."""
+        key = self.key(wiki)
+        with self.lock:
+            content = self.pending.get(key)
+            if content is None:
+                row = self.db.execute(
+                    'SELECT content FROM conversions WHERE key = ?',
+                    (key,)).fetchone()
+                if row is None:
+                    return None
+                content = row[0]
+            self.used += 1
+            self.touched[key] = self.used
+            return content
+
+    def put(self, wiki, content):
+        """Remember the conversion of some markup."""
+        key = self.key(wiki)
+        with self.lock:
+            self.used += 1
+            self.pending[key] = content
+            self.touched[key] = self.used
+
+    def close(self):
+        """Write the cache out, and evict the least recently used entries."""
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO conversions '
+                                'VALUES (?, ?, ?)',
+                                [(key, content, self.touched[key])
+                                 for key, content in self.pending.items()])
+            self.db.executemany('UPDATE conversions SET used = ? '
+                                'WHERE key = ?',
+                                [(used, key)
+                                 for key, used in self.touched.items()
+                                 if key not in self.pending])
+            self.db.execute('DELETE FROM conversions WHERE key NOT IN '
+                            '(SELECT key FROM conversions '
+                            'ORDER BY used DESC LIMIT ?)', (self.size,))
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""Cross References
+
+This module checks the links between the pages of the documentation.  The
+see-also section of an element refers to other elements by type, name and,
+optionally, module, and these become links to the titles those elements'
+pages would have, whether they have one or not.  An index of the pages of
+every element in a dump, keyed by (type, name, module), finds the links that
+lead nowhere, so they can be fixed before anyone follows them.
+
+A link to a module that doesn't document the element is a broken link, but
+if there's a page for the element without a module it's most likely the one
+meant; these are reported as fallbacks, with the title they fall back to.
+
+Run as a script, it checks every link in a documentation file.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import sys
+import time
+from optparse import OptionParser
+
+import lxml.etree as etree
+
+from wikirender import LINKS
+
+
+def title(prefix, tag, name, module):
+    """The title of an element's page, as page_title() of astxml2wiki.py
+    names it"""
+    if module:
+        return '%s%s%s_%s' % (prefix, LINKS[tag], name, module)
+    return '%s%s%s' % (prefix, LINKS[tag], name)
+
+
+def target(ref):
+    """What a ref links to: (type, name, module), with the name as the
+    stylesheet reads it"""
+    name = etree.tostring(ref, method='text', encoding=unicode,
+                          with_tail=False)
+    return ref.get('type'), ' '.join(name.split()), ref.get('module', '')
+
+
+class Index:
+    """The pages of the elements in a dump, and the links between them."""
+
+    def __init__(self, prefix=''):
+        """Keyword Arguments:
+        prefix -- Page title prefix (e.g. 'Asterisk 13 ').
+        """
+        self.prefix = prefix
+        self.titles = {}
+        self.links = []
+
+    def share(self, other):
+        """Use the pages and links another index found in the same
+        documentation, which is being published under another prefix."""
+        self.titles = dict((key, title(self.prefix, *key))
+                           for key in other.titles)
+        self.links = other.links
+
+    def add(self, element):
+        """Index the page of an element."""
+        name = element.get('name')
+        if element.tag in LINKS and name:
+            key = (element.tag, name, element.get('module', ''))
+            self.titles[key] = title(self.prefix, *key)
+
+    def refs(self, element):
+        """Note the links in the see-also sections of an element's page."""
+        source = None
+        for see_also in element.iter('see-also'):
+            for ref in see_also.iterchildren('ref'):
+                if ref.get('type') not in LINKS:
+                    continue
+                if source is None:
+                    source = (element.tag, element.get('name', ''),
+                              element.get('module', ''))
+                self.links.append((source, target(ref)))
+
+    def resolve(self, key):
+        """The title of the page a link leads to, and whether that page was
+        found by dropping the link's module.  The title is None if there is
+        no such page."""
+        found = self.titles.get(key)
+        if found is not None:
+            return found, False
+        if key[2]:
+            found = self.titles.get((key[0], key[1], ''))
+            if found is not None:
+                return found, True
+        return None, False
+
+    def check(self):
+        """The links that lead nowhere, as (from, to) titles, and the links
+        that fall back to a page without a module, as (from, to, fallback)
+        titles."""
+        dangling = []
+        fallbacks = []
+        for source, key in self.links:
+            source = title(self.prefix, *source)
+            found, fallback = self.resolve(key)
+            if found is None:
+                dangling.append((source, title(self.prefix, *key)))
+            elif fallback:
+                fallbacks.append((source, title(self.prefix, *key), found))
+        return dangling, fallbacks
+
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options] asterisk-docs.xml")
+    parser.add_option("--prefix", default="",
+                      help="Page title prefix, e.g. 'Asterisk 13 '")
+    (options, args) = parser.parse_args(argv)
+
+    if len(args) != 2:
+        parser.error("Wrong number of arguments")
+
+    tree = etree.parse(args[1])
+    tree.xinclude()
+
+    started = time.time()
+    index = Index(options.prefix)
+    for element in tree.iter(*LINKS):
+        index.add(element)
+        index.refs(element)
+    dangling, fallbacks = index.check()
+    elapsed = time.time() - started
+
+    for source, missing in dangling:
+        print "%s links to missing %s" % (source, missing)
+    for source, missing, found in fallbacks:
+        print "%s links to missing %s, falls back to %s" % (source, missing,
+                                                            found)
+    print "%d links between %d pages, %d dangling, %d fall back (%.3fs)" % (
+        len(index.links), len(index.titles), len(dangling), len(fallbacks),
+        elapsed)
+    return (dangling or fallbacks) and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)
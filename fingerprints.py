@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""Documentation Fingerprints
+
+This module tells which elements of the XML documentation changed between two
+dumps of it.  Each documented element (an application, a function, a manager
+action and so on) is keyed by its tag, name and module, and fingerprinted with
+a hash of its canonical XML.  Fingerprints can be saved to a file, so the
+next run can be compared against them without keeping the old dump around.
+
+An element's page also depends on what renders it and on the prefix of the
+page titles, which the links between pages use as well.  Saved fingerprints
+are kept with a hash of those (see renderer()), and fingerprints saved for
+another renderer or prefix aren't used: every element counts as changed.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import hashlib
+import json
+import os
+
+import lxml.etree as etree
+
+
+def key(element):
+    """The key an element is compared by: 'tag/name/module'."""
+    return '%s/%s/%s' % (element.tag, element.get('name', ''),
+                         element.get('module', ''))
+
+
+def split_key(k):
+    """Split a key back into its tag, name and module."""
+    return tuple(k.split('/', 2))
+
+
+def fingerprint(element):
+    """Hash an element's canonical XML, which ignores the formatting of the
+    dump but not any change to the documentation."""
+    return hashlib.sha1(etree.tostring(element, method='c14n',
+                                       with_tail=False)).hexdigest()
+
+
+def renderer(paths, prefix):
+    """Hash what pages are rendered with: the files that render them, and
+    the prefix of their titles."""
+    digest = hashlib.sha1(prefix)
+    for path in paths:
+        f = open(path, 'rb')
+        try:
+            digest.update(f.read())
+        finally:
+            f.close()
+    return digest.hexdigest()
+
+
+def load(path, topics, rendered=None):
+    """Load fingerprints, either saved by save() or computed from an old
+    dump of the documentation.  Saved fingerprints are only used if they
+    were saved for pages rendered the same way.
+
+    Keyword Arguments:
+    path -- A fingerprint file (.json), or the XML documentation.
+    topics -- The tags of the elements that are documented.
+    rendered -- How the pages are rendered now, from renderer().
+    """
+    if os.path.splitext(path)[1] == '.json':
+        f = open(path, 'r')
+        try:
+            saved = json.load(f)
+        finally:
+            f.close()
+        # Files saved before the renderer was kept have none
+        if saved.get('renderer') != rendered:
+            return {}
+        return saved['elements']
+
+    tree = etree.parse(path)
+    tree.xinclude()
+    prints = {}
+    for element in tree.getiterator():
+        if element.tag in topics:
+            prints[key(element)] = fingerprint(element)
+    return prints
+
+
+def save(path, prints, rendered=None):
+    """Write fingerprints out, for a later load(), with how the pages they
+    were published to were rendered."""
+    tmp = '%s.tmp' % path
+    f = open(tmp, 'w')
+    try:
+        json.dump({'renderer': rendered, 'elements': prints}, f, indent=0,
+                  sort_keys=True)
+    finally:
+        f.close()
+    os.rename(tmp, path)
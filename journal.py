@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""Publish Journal
+
+This module keeps a checkpoint of a publishing run in progress.  As each page
+is published a line is appended to the journal, and forced to disk, with the
+page's title, the hash of the source it was published from and the version
+the server gave it.  If the run dies, the next one can resume from the
+journal, skipping the pages that were already published.  A run that
+completes removes its journal, as the manifest then holds the same record.
+
+Each space and prefix (each branch) has a journal of its own, so that one
+branch's run doesn't wipe out another's.  A journal is locked for as long as
+a run has it open; a second run publishing the same branch is turned away.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import errno
+import fcntl
+import json
+import os
+import re
+import threading
+
+
+def default_path(space, prefix):
+    """The journal of a space and prefix, next to the scripts with the
+    manifest"""
+    name = '-'.join(re.sub(r'[^A-Za-z0-9.]+', '_', part)
+                    for part in [space, prefix.strip()] if part)
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'publish-journal-%s.jsonl' % name)
+
+
+class Journal:
+    """An append-only record of the pages published by a run."""
+
+    def __init__(self, path, resume=False):
+        """Start a journal, or carry on with an existing one.
+
+        Keyword Arguments:
+        path -- The file the journal is kept in.
+        resume -- Whether to keep (and load) what's already in the journal.
+
+        Raises IOError if another run has the journal open.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+
+        # Held until close(), so nothing else truncates or removes the journal
+        self.flock = open('%s.lock' % path, 'w')
+        try:
+            fcntl.flock(self.flock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            self.flock.close()
+            raise IOError(e.errno, 'In use by another run', path)
+
+        if resume and os.path.exists(path):
+            f = open(path, 'r')
+            try:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The run died part way through writing this line
+                        continue
+                    self.entries[entry['key']] = entry
+            finally:
+                f.close()
+
+        self.file = open(path, resume and 'a' or 'w')
+
+    def done(self, key, digest):
+        """Whether a page was published from source with this hash."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry['digest'] == digest
+
+    def record(self, key, title, digest, version):
+        """Note that a page has been published, before going on."""
+        entry = {
+            'key': key,
+            'title': title,
+            'digest': digest,
+            'version': version,
+        }
+        with self.lock:
+            self.entries[key] = entry
+            self.file.write(json.dumps(entry, sort_keys=True) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self, complete=True):
+        """Close the journal, removing it if the run completed."""
+        with self.lock:
+            self.file.close()
+            try:
+                if complete:
+                    os.remove(self.path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            finally:
+                self.flock.close()
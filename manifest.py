@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Publish Manifest
+
+This module keeps a record of what was last published to Confluence.  For
+every page it stores a hash of the source the page was published from, so a
+later run can tell that a page is unchanged without asking the server.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+# Next to the scripts, where astxml2wiki.py is run from by publish.sh
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'publish-manifest.json')
+
+
+class Manifest:
+    """A persistent map of page keys to the hash of their published source.
+
+    Pages are keyed by space, prefix and page title, so one manifest file can
+    be shared by publishes to several spaces or branches.
+    """
+
+    def __init__(self, path):
+        """Load a manifest, if one has already been written.
+
+        Keyword Arguments:
+        path -- The file the manifest is kept in.
+        """
+        self.path = path
+        self.hashes = {}
+        self.lock = threading.Lock()
+        # Hashes recorded since the manifest was last saved
+        self.recorded = {}
+
+        if os.path.exists(path):
+            f = open(path, 'r')
+            try:
+                self.hashes = json.load(f)
+            finally:
+                f.close()
+
+    @staticmethod
+    def key(space, prefix, title):
+        """Build the manifest key for a page."""
+        return '%s/%s/%s' % (space, prefix.strip(), title)
+
+    @staticmethod
+    def digest(content):
+        """Hash page source, as given to unchanged() and record()."""
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        return hashlib.sha1(content).hexdigest()
+
+    def unchanged(self, key, digest):
+        """Whether a page was last published from source with this hash."""
+        with self.lock:
+            return self.hashes.get(key) == digest
+
+    def record(self, key, digest):
+        """Note that a page now matches source with this hash."""
+        with self.lock:
+            if self.hashes.get(key) != digest:
+                self.hashes[key] = digest
+                self.recorded[key] = digest
+
+    def save(self):
+        """Write the manifest back out, if anything was recorded.
+
+        publish.sh runs both scripts at once with the same manifest, so what
+        other processes have saved in the meantime is merged with, rather
+        than overwritten.
+        """
+        with self.lock:
+            if not self.recorded:
+                return
+            lock = open('%s.lock' % self.path, 'w')
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.exists(self.path):
+                    f = open(self.path, 'r')
+                    try:
+                        self.hashes = json.load(f)
+                    finally:
+                        f.close()
+                self.hashes.update(self.recorded)
+
+                tmp = '%s.tmp' % self.path
+                f = open(tmp, 'w')
+                try:
+                    json.dump(self.hashes, f, indent=0, sort_keys=True)
+                finally:
+                    f.close()
+                os.rename(tmp, self.path)
+                self.recorded = {}
+            finally:
+                lock.close()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""Page Mirror
+
+This module keeps a local copy of the pages the publishing scripts read from
+and write to Confluence, so that comparing the documentation with what's on
+the server doesn't mean fetching every page again.  Each page is kept whole,
+as the server gave it, along with its id and version.  A page is fetched
+again only when the server lists it at a version other than the mirrored
+one; pages the scripts store or update are mirrored at the version the
+server gave them back.
+
+Where the server doesn't list versions there's no telling whether a mirrored
+page is current, so it isn't used; the pages are fetched as before.  This is
+the case with Confluence's own XML-RPC API: the page summaries getChildren and
+getPages return have no version, and no call lists the versions of many pages
+at once.  So the mirror is only kept when asked for (--mirror), for servers
+that do list them.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import sqlite3
+import threading
+import xmlrpclib
+
+
+class Mirror:
+    """An on-disk copy of pages on a Confluence server."""
+
+    def __init__(self, path, server):
+        """Open (or create) a mirror.
+
+        Keyword Arguments:
+        path -- The SQLite database the pages are kept in.
+        server -- Identifies the server the pages are on, usually its URL.
+        """
+        self.server = server
+        self.lock = threading.Lock()
+        # Writes are kept until close(), so that another script using the
+        # mirror at the same time isn't locked out of it for the whole run
+        self.pending = {}
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages '
+                        '(server TEXT, id TEXT, version TEXT, title TEXT, '
+                        'page TEXT, PRIMARY KEY (server, id))')
+
+    def get(self, page_id, version=None):
+        """The mirrored copy of a page, if it's at the given version (or,
+        without one, at any version); otherwise None."""
+        page_id = str(page_id)
+        with self.lock:
+            row = self.pending.get(page_id)
+            if row is None:
+                row = self.db.execute(
+                    'SELECT version, page FROM pages '
+                    'WHERE server = ? AND id = ?',
+                    (self.server, page_id)).fetchone()
+                if row is None:
+                    return None
+        if version is not None and row[0] != str(version):
+            return None
+        return xmlrpclib.loads(row[1].encode('utf-8'))[0][0]
+
+    def put(self, page):
+        """Mirror a page fetched from the server, or returned by it after
+        storing or updating the page.  Pages without their content, or
+        their version, aren't kept."""
+        if page.get('content') is None or page.get('version') is None:
+            return
+        data = xmlrpclib.dumps((page,), allow_none=True).decode('utf-8')
+        with self.lock:
+            self.pending[str(page['id'])] = (str(page['version']), data,
+                                             page.get('title'))
+
+    def close(self):
+        """Write out the pages mirrored during the run."""
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO pages '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                [(self.server, page_id, version, title, data)
+                                 for page_id, (version, data, title)
+                                 in self.pending.items()])
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""Multi-branch Publishing
+
+Publishes the documentation of several Asterisk branches in one process.
+Each branch is given as FILE:PREFIX:VERSION - the XML documentation dumped
+from the branch, its page title prefix and its version string.  The branches
+share one login, pool of connections, compiled stylesheet, manifest and
+conversion cache, and branches documented by the same file share one parse of
+it.  Any other options are passed on to astxml2wiki.py for every branch.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import sys
+import threading
+import Queue
+
+import astxml2wiki
+
+# Options that differ from branch to branch, so are given in the branch specs
+BRANCH_OPTIONS = ['--file', '--prefix', '--ast-version', '--svn']
+
+# Options that only make sense for a single branch
+SINGLE_OPTIONS = ['--since', '--save-fingerprints']
+
+
+def publish_group(session, options, branches):
+    """Publish the branches documented by one file, one after another, so
+    that the parsed documentation is only ever used by one of them at a
+    time."""
+    elements = None
+    for docs, prefix, version in branches:
+        argv = ['astxml2wiki.py'] + options + [
+            '--file=%s' % docs,
+            '--prefix=%s' % prefix,
+            '--ast-version=%s' % version,
+        ]
+        branch = astxml2wiki.AstXML2Wiki(argv, session)
+        if elements is None or branch.args['stream'] is True:
+            branch.parse()
+            elements = branch.elements
+            xrefs = branch.xrefs
+        else:
+            branch.elements = elements
+            branch.xrefs.share(xrefs)
+        branch.update()
+        if branch.args['v'] is True and not branch.args['debug']:
+            for k in branch.processed:
+                print prefix, k, " ", branch.processed[k]
+
+
+def worker(session, options, groups, failed):
+    """Publish groups of branches from the queue until told to stop"""
+    while True:
+        group = groups.get()
+        if group is None:
+            return
+        try:
+            publish_group(session, options, group)
+        except:
+            print >> sys.stderr, "Failed to publish %s" % \
+                ', '.join(prefix for docs, prefix, version in group)
+            failed.append(sys.exc_info())
+
+
+def main(argv):
+    usage = "Usage: ./publish-branches.py [--branch-jobs=N] " \
+        "[astxml2wiki.py options] FILE:PREFIX:VERSION..."
+
+    options = []
+    branches = []
+    branch_jobs = '1'
+    jobs = '1'
+    for a in argv[1:]:
+        name = a.split('=', 1)[0]
+        if name == '--branch-jobs':
+            branch_jobs = a.split('=', 1)[-1]
+        elif name in BRANCH_OPTIONS:
+            print >> sys.stderr, "%s is given per branch, as FILE:PREFIX:VERSION" % name
+            print >> sys.stderr, usage
+            return 2
+        elif name in SINGLE_OPTIONS:
+            print >> sys.stderr, "%s can't be used with several branches" % name
+            return 2
+        elif a.startswith('-'):
+            if name == '--jobs':
+                jobs = a.split('=', 1)[-1]
+            options.append(a)
+        else:
+            pieces = a.split(':', 2)
+            if len(pieces) != 3:
+                print >> sys.stderr, "Bad branch '%s'" % a
+                print >> sys.stderr, usage
+                return 2
+            branches.append(pieces)
+
+    if not branches:
+        print >> sys.stderr, usage
+        return 2
+
+    try:
+        branch_jobs = int(branch_jobs)
+        connections = int(jobs) * branch_jobs
+    except ValueError:
+        branch_jobs = 0
+    if branch_jobs < 1:
+        print >> sys.stderr, "--branch-jobs and --jobs must be positive numbers."
+        return 2
+
+    # Branches documented by the same file are published together
+    groups = []
+    for branch in branches:
+        for group in groups:
+            if group[0][0] == branch[0]:
+                group.append(branch)
+                break
+        else:
+            groups.append([branch])
+
+    # Logs in, and holds everything the branches share
+    session = astxml2wiki.AstXML2Wiki(['astxml2wiki.py'] + options + [
+        '--file=%s' % branches[0][0],
+        '--connections=%d' % connections,
+    ])
+
+    queue = Queue.Queue()
+    failed = []
+    workers = []
+    for group in groups:
+        queue.put(group)
+    for i in range(min(branch_jobs, len(groups))):
+        queue.put(None)
+        worker_thread = threading.Thread(target=worker,
+                                         args=(session, options, queue, failed))
+        worker_thread.daemon = True
+        worker_thread.start()
+        workers.append(worker_thread)
+    for worker_thread in workers:
+        worker_thread.join()
+
+    session.close(not failed)
+
+    if failed:
+        raise failed[0][0], failed[0][1], failed[0][2]
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)
@@ -7,11 +7,21 @@ import difflib
 import getpass
 import os
 import sys
+import threading
+import time
 import xmlrpclib
 import xml.dom.minidom
+import Queue
+
+import confluence
+import convcache
+import manifest
+import mirror
+import runreport
+import storageformat
+import wikiconvert
 
 from optparse import OptionParser
-from xmlrpclib import Server
 
 def fail(msg):
     print >> sys.stderr, msg
@@ -24,6 +34,215 @@ def read_fully(file):
     finally:
         fd.close()
 
+class Publisher:
+    """Publishes ARI wiki pages under the "<prefix> ARI" parent page.
+
+    Pages are published from a pool of worker threads; see run().
+    """
+
+    def __init__(self, api, options, space, prefix, parentId, convert,
+                 cache=None, published=None, report=None, pages=None):
+        self.api = api
+        self.options = options
+        self.space = space
+        self.prefix = prefix
+        self.parentId = parentId
+        self.convert = convert
+        self.cache = cache
+        self.manifest = published
+        self.mirror = pages
+        self.report = report or runreport.Report('publish-rest-api.py')
+        self.processed = {
+            'unchanged': 0,
+            'updated': 0,
+            'created': 0,
+        }
+
+        # The lock guards the output, so each page's lines stay together
+        self.lock = threading.Lock()
+        self.failed = None
+        self.index = {}
+        self.versions = {}
+
+    def index_pages(self):
+        """List the existing ARI pages in one call, instead of a getPage
+        for each file just to find out whether its page exists."""
+        with self.report.phase('index'):
+            children = self.api.getChildren(str(self.parentId))
+        for child in children:
+            self.index[child['title']] = child['id']
+            self.versions[child['title']] = child.get('version')
+        if self.options.verbose:
+            print >> sys.stderr, "Found %d existing pages" % len(self.index)
+
+    def run(self, files):
+        """Publish (page title, path) pairs.  Files whose content hasn't
+        changed since they were last published are skipped here; the rest
+        are handed to the workers, a bounded number at a time."""
+        pages = Queue.Queue(self.options.jobs * 2)
+        workers = []
+        for i in range(self.options.jobs):
+            worker = threading.Thread(target=self.worker, args=(pages,))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        for page_title, wiki in files:
+            if self.failed:
+                break
+            with self.report.phase('read'):
+                content = read_fully(wiki)
+
+            key = digest = None
+            if self.manifest:
+                key = manifest.Manifest.key(self.space, self.prefix,
+                                            page_title)
+                digest = manifest.Manifest.digest(content)
+                if not self.options.verify_remote and \
+                    self.manifest.unchanged(key, digest):
+                    with self.lock:
+                        self.processed['unchanged'] += 1
+                    if self.options.verbose:
+                        print "Skipping %s (unchanged)" % page_title
+                    continue
+
+            pages.put((page_title, wiki, content, key, digest))
+
+        for worker in workers:
+            pages.put(None)
+        for worker in workers:
+            worker.join()
+
+        if self.failed:
+            raise self.failed[0], self.failed[1], self.failed[2]
+
+    def worker(self, pages):
+        """Publish pages from the queue until told to stop.  The first
+        failure is kept so run() can re-raise it once the pool drains."""
+        while True:
+            page = pages.get()
+            if page is None:
+                return
+            if self.failed:
+                continue
+            try:
+                started = time.time()
+                with self.report.phase('publish'):
+                    self.publish(*page)
+                self.report.page(page[0], time.time() - started)
+            except:
+                with self.lock:
+                    if not self.failed:
+                        self.failed = sys.exc_info()
+
+    def convert_wiki(self, content):
+        """Convert wiki markup to storage format, locally or on the server"""
+        with self.report.phase('convert'):
+            if self.options.local_convert:
+                return wikiconvert.convert(content.decode('utf-8'))
+
+            converted = self.cache and self.cache.get(content)
+            if converted is None:
+                converted = self.api.convertWikiToStorageFormat(content)
+                if self.cache:
+                    self.cache.put(content, converted)
+            return converted
+
+    def find_page(self, page_title):
+        """Fetch an existing page, or return None if there isn't one.
+        Pages that aren't under the ARI parent are looked up by title."""
+        if page_title in self.index:
+            return self.fetch_page(self.index[page_title],
+                                   self.versions[page_title])
+        try:
+            return self.api.getPage(self.space, page_title)
+        except xmlrpclib.Fault:
+            return None
+
+    def fetch_page(self, page_id, version):
+        """Fetch a page, from the mirror if it has the version the server
+        lists the page at.  A page listed without a version is always
+        fetched, as the mirrored copy may be out of date."""
+        if self.mirror and version is not None:
+            page = self.mirror.get(page_id, version)
+            if page is not None:
+                self.report.count({'mirrored': 1})
+                return page
+        page = self.api.getPage(page_id)
+        if self.mirror:
+            self.mirror.put(page)
+        return page
+
+    def publish(self, page_title, wiki, content, key, digest):
+        """Create or update a single page"""
+        comment = {
+            'minorEdit': True,
+            'versionComment': 'Update to %s' % self.options.ast_version
+        }
+
+        # convert wiki markup to storage format, if needed
+        if self.convert:
+            content = self.convert_wiki(content)
+
+        page = self.find_page(page_title)
+        if page is not None:
+            oldcontent = page['content']
+
+            # The server's copy of the storage format differs from a fresh
+            # conversion in ways that don't matter; see storageformat.py.
+            if self.convert:
+                changed = not storageformat.same(oldcontent, content)
+            else:
+                changed = oldcontent != content
+
+            if changed:
+                page['content'] = content
+                page['parentId'] = self.parentId
+
+                if not self.options.dry_run:
+                    page = self.api.updatePage(page, comment)
+                    if self.mirror:
+                        self.mirror.put(page)
+                    if key:
+                        self.manifest.record(key, digest)
+                with self.lock:
+                    self.processed['updated'] += 1
+                    if self.options.dry_run:
+                        print "Updating %s (dry run)" % page_title
+                    else:
+                        print "Updating %s" % page_title
+                    if self.options.verbose:
+                        diff = difflib.unified_diff(oldcontent.splitlines(1), content.splitlines(1), fromfile=page_title, tofile=wiki)
+                        for line in diff:
+                            sys.stdout.write(line)
+            else:
+                if key and not self.options.dry_run:
+                    self.manifest.record(key, digest)
+                with self.lock:
+                    self.processed['unchanged'] += 1
+                    if self.options.verbose:
+                        print "Skipping %s (up to date)" % page_title
+        else:
+            newpage = {
+                'space': self.space,
+                'parentId': self.parentId,
+                'title': page_title,
+                'content': content,
+            }
+            if self.options.dry_run:
+                with self.lock:
+                    self.processed['created'] += 1
+                    print "Creating %s (dry run)" % page_title
+            else:
+                page = self.api.storePage(newpage)
+                if self.mirror:
+                    self.mirror.put(page)
+                if key:
+                    self.manifest.record(key, digest)
+                with self.lock:
+                    self.processed['created'] += 1
+                    print "Creating %s" % page_title
+
 def main(argv):
     parser = OptionParser(usage = "usage: %prog [options] http://server/wiki/rpc/xmlrpc SPACE 'Asterisk 12'")
     parser.add_option("--username", dest="username", help="Confluence username")
@@ -32,11 +251,39 @@ def main(argv):
     parser.add_option("--dry-run", action="store_true", dest="dry_run", default=False, help="Don't make changes")
     parser.add_option("--ast-version", default="Unknown version",
                       help="Asterisk version string, including SVN info")
+    parser.add_option("--local-convert", action="store_true",
+                      dest="local_convert", default=False,
+                      help="Convert wiki markup locally, not on the server")
+    parser.add_option("--conversion-cache", default=convcache.DEFAULT_PATH,
+                      help="Cache of server conversions; empty to disable")
+    parser.add_option("--conversion-cache-size", type="int",
+                      default=convcache.DEFAULT_SIZE,
+                      help="Most conversions to keep in the cache")
+    parser.add_option("--mirror", default="",
+                      help="Local copy of the pages on the server, for "
+                      "servers that list page versions")
+    parser.add_option("--retries", type="int", default=5,
+                      help="Times to retry a read after a connection failure")
+    parser.add_option("--rate", type="float", default=0,
+                      help="Most calls per second to make; 0 for no limit")
+    parser.add_option("--jobs", type="int", default=1,
+                      help="Pages to publish concurrently")
+    parser.add_option("--manifest", default=manifest.DEFAULT_PATH,
+                      help="Record of published pages; empty to disable")
+    parser.add_option("--verify-remote", action="store_true",
+                      dest="verify_remote", default=False,
+                      help="Compare every page with the server's copy")
+    parser.add_option("--report", default=os.path.join(
+                          os.path.dirname(os.path.abspath(__file__)),
+                          'publish-rest-api-report.json'),
+                      help="Where to write the run report; empty to disable")
 
     (options, args) = parser.parse_args(argv)
 
     if len(args) != 4:
         parser.error("Wrong number of arguments")
+    if options.jobs < 1:
+        parser.error("--jobs must be a positive number")
 
     url = args[1]
     space = args[2]
@@ -54,21 +301,18 @@ def main(argv):
     if not options.password:
         options.password = getpass.getpass()
 
-    server = Server(url)
-    try:
-        token = server.confluence2.login(options.username, options.password)
-        api = server.confluence2
-        convert = True
-    except:
-        token = server.confluence1.login(options.username, options.password)
-        api = server.confluence1
-        convert = False
+    report = runreport.Report('publish-rest-api.py')
+    api = confluence.Confluence(url, connections=options.jobs,
+                                retries=options.retries, rate=options.rate,
+                                report=report)
+    token = api.login(options.username, options.password)
+    convert = api.version == 'confluence2'
 
     if not token:
         fail("Could not log into Confluence!")
 
     try:
-        parent = api.getPage(token, space, "%s ARI" % prefix)
+        parent = api.getPage(space, "%s ARI" % prefix)
         parentId = parent['id']
     except xmlrpclib.Fault, e:
         print("Page '%s ARI' doesn't exist" % prefix)
@@ -77,7 +321,7 @@ def main(argv):
             return
         else:
             print("Creating '%s ARI'" % prefix)
-            parent = api.getPage(token, space, "%s Command Reference" % prefix)
+            parent = api.getPage(space, "%s Command Reference" % prefix)
 
             newpage = {
                 'space': space,
@@ -85,66 +329,49 @@ def main(argv):
                 'title': "%s ARI" % prefix,
                 'content': "",
             }
-            api.storePage(token, newpage)
-            parent = api.getPage(token, space, "%s ARI" % prefix)
+            api.storePage(newpage)
+            parent = api.getPage(space, "%s ARI" % prefix)
             parentId = parent['id']
 
     if options.verbose:
         print >> sys.stderr, "Parent page id %s" % parentId
 
-    for wiki in os.listdir(wikidir):
+    cache = None
+    if convert and not options.local_convert and options.conversion_cache:
+        cache = convcache.ConversionCache(options.conversion_cache, url,
+                                          options.conversion_cache_size)
+
+    published = None
+    if options.manifest:
+        published = manifest.Manifest(options.manifest)
+
+    pages = None
+    if options.mirror:
+        pages = mirror.Mirror(options.mirror, url)
+
+    files = []
+    for wiki in sorted(os.listdir(wikidir)):
         if not wiki.endswith('.wiki') or not wiki.startswith(prefix):
             print >> sys.stderr, "Unexpected file '%s' in wiki directory" % wiki
             continue
         page_title = wiki.replace('.wiki', '')
-        wiki = os.path.join(wikidir, wiki)
-
-        comment = {
-            'minorEdit': True,
-            'versionComment': 'Update to %s' % options.ast_version
-        }
-        content = read_fully(wiki)
+        files.append((page_title, os.path.join(wikidir, wiki)))
 
-        # convert wiki markup to storage format, if needed
-        # Confluence is inconsistent how it renders <br/> tags. ugh.
-        if convert:
-            content = api.convertWikiToStorageFormat(token, content).replace("<br />", "<br/>")
-
-        try:
-            page = api.getPage(token, space, page_title)
-            oldcontent = page['content']
-
-            if convert:
-                oldcontent = oldcontent.replace("<br />", "<br/>").replace("&quot;", "\"")
-
-            if oldcontent != content:
-                page['content'] = content
-                page['parentId'] = parentId
-
-                if options.dry_run:
-                    print "Updating %s (dry run)" % page_title
-		else:
-                    print "Updating %s" % page_title
-                    api.updatePage(token, page, comment)
-                if options.verbose:
-                    diff = difflib.unified_diff(oldcontent.splitlines(1), content.splitlines(1), fromfile=page_title, tofile=wiki)
-                    for line in diff:
-                        sys.stdout.write(line)
-            else:
-                if options.verbose:
-                    print "Skipping %s (up to date)" % page_title
-        except xmlrpclib.Fault, e:
-            newpage = {
-                'space': space,
-                'parentId': parentId,
-                'title': page_title,
-                'content': content,
-            }
-            if options.dry_run:
-                print "Creating %s (dry run)" % page_title
-	    else:
-                print "Creating %s" % page_title
-                api.storePage(token, newpage)
+    publisher = Publisher(api, options, space, prefix, parentId, convert,
+                          cache, published, report, pages)
+    try:
+        publisher.index_pages()
+        publisher.run(files)
+    finally:
+        if published:
+            published.save()
+        if cache:
+            cache.close()
+        if pages:
+            pages.close()
+        report.count(publisher.processed)
+        if options.report:
+            report.save(options.report)
 
 
 if __name__ == "__main__":
@@ -27,6 +27,63 @@ function usage()
     echo "usage: ${PROGNAME} [--dry-run] branch-name"
 }
 
+# Wait for a stage running in the background, then show its output
+function wait_stage()
+{
+    local pid=$1 log=$2 status=0
+    wait ${pid} || status=$?
+    cat ${log}
+    return ${status}
+}
+
+# Wait up to $1 seconds for a command to succeed
+function wait_for()
+{
+    local timeout=$1
+    shift
+    local deadline=$(( $(date +%s) + ${timeout} ))
+    until "$@" > /dev/null 2>&1; do
+        if test $(date +%s) -ge ${deadline}; then
+            fail "Timed out waiting for: $*"
+        fi
+        sleep 0.1
+    done
+}
+
+# Keep the documentation generated from this tree, evicting all but the
+# most recently used entries
+function store_docs()
+{
+    local tmp=${DOCS_CACHE}.tmp.$$
+    rm -rf ${tmp}
+    mkdir -p ${tmp}
+    cp ${TOPDIR}/asterisk-docs.xml ${tmp}/
+    if test ${HAS_REST_API}; then
+        cp -r doc/rest-api ${tmp}/rest-api
+    fi
+    rm -rf ${DOCS_CACHE}
+    mv ${tmp} ${DOCS_CACHE}
+    ls -1td ${AST_DOCS_CACHE}/*/ | \
+        tail -n +$(( ${AST_DOCS_CACHE_SIZE} + 1 )) | xargs rm -rf
+}
+
+# Stop any stages still running in the background, when we fail.  The REST
+# API publish is left to finish instead: killed, it would lose its manifest,
+# mirror and report.
+function cleanup()
+{
+    local pid
+    for pid in $(jobs -p); do
+        if test "${pid}" != "${REST_API_PID}"; then
+            kill ${pid} 2> /dev/null || true
+        fi
+    done
+    if test -n "${REST_API_PID}" && jobs -p | grep -qx "${REST_API_PID}"; then
+        wait_stage ${REST_API_PID} ${STAGE_LOGS}/rest-api.log || true
+    fi
+    rm -rf ${STAGE_LOGS}
+}
+
 DRY_RUN=false
 while test $# -gt 0; do
     case $1 in
@@ -71,6 +128,20 @@ export CONFLUENCE_PASSWORD
 # default space to AST
 : ${CONFLUENCE_SPACE:=AST}
 
+# number of pages to publish concurrently
+: ${CONFLUENCE_JOBS:=1}
+
+# Asterisk builds are kept here, and reused if the revision hasn't changed
+: ${AST_BUILD_CACHE:=${HOME}/.cache/ast-publish-docs}
+
+# seconds to wait for Asterisk to start
+: ${AST_BOOT_TIMEOUT:=120}
+
+# Generated documentation is kept here, and reused if neither the source tree
+# nor the menuselect options have changed
+: ${AST_DOCS_CACHE:=${AST_BUILD_CACHE}/docs}
+: ${AST_DOCS_CACHE_SIZE:=10}
+
 #
 # Check repository
 #
@@ -97,6 +168,13 @@ if test -d rest-api; then
     HAS_REST_API=true
 fi
 
+#
+# Stages that don't depend on each other run in the background, with their
+# output kept here until they're done
+#
+STAGE_LOGS=$(mktemp -d /tmp/ast-publish-docs.XXXXXX)
+trap cleanup EXIT
+
 #
 # Create a virtualenv to install dependencies
 #
@@ -105,37 +183,74 @@ if ! test -d ~/virtualenv/ast-publish-docs; then
     virtualenv ~/virtualenv/ast-publish-docs
 fi
 . ~/virtualenv/ast-publish-docs/bin/activate
-pip install -Ur ${TOPDIR}/requirements.txt
+# Nothing needs the dependencies until make ari-stubs, so configure meanwhile
+pip install -Ur ${TOPDIR}/requirements.txt > ${STAGE_LOGS}/pip.log 2>&1 &
+PIP_PID=$!
 
 if test configure -nt makeopts; then
-    # Build into a temporary directory
-    AST_DIR=$(mktemp -d /tmp/ast-docs.XXXXXX)
-    trap "rm -rf $AST_DIR" EXIT
+    # Build into a directory kept between runs
+    AST_DIR=${AST_BUILD_CACHE}/${BRANCH_NAME}
+    AST_STAMP=${AST_DIR}/.revision
+    mkdir -p ${AST_DIR}
 
     ./configure --prefix=${AST_DIR} --enable-dev-mode=noisy
 else
     # Dev machine already configured for building
     AST_DIR=$(sed -n "s/^prefix='\([^']*\)'/\1/ p" config.log)
+    # which may have been installed from anything, so always build
+    unset AST_STAMP
 fi
 
 AST_VER=$(export GREP; export AWK; ./build_tools/make_version .)
+AST_REV=$(${GIT} rev-parse HEAD)
+
+#
+# The documentation depends on the source and, from 12 on, the modules built,
+# so look for it in the cache by the tree's hash and the menuselect options.
+# Older branches (and master, which is only checked) build no modules.
+#
+case ${BRANCH_NAME} in
+    master|1.8|10*|11)
+        MODULES=
+        ;;
+    *)
+        make menuselect.makeopts
+        MODULES=$(cat menuselect.makeopts)
+        ;;
+esac
+DOCS_KEY=$( (${GIT} rev-parse HEAD^{tree}; echo "${MODULES}") | \
+    sha1sum | cut -d ' ' -f 1)
+DOCS_CACHE=${AST_DOCS_CACHE}/${DOCS_KEY}
+DOCS_CACHED=false
+if test -f ${DOCS_CACHE}/asterisk-docs.xml; then
+    DOCS_CACHED=true
+    touch ${DOCS_CACHE}
+fi
+
+wait_stage ${PIP_PID} ${STAGE_LOGS}/pip.log
 
 #
 # Check ARI documentation consistency
 #
 if test ${HAS_REST_API}; then
-    # Generate latest ARI documentation
-    make ari-stubs
+    if ${DOCS_CACHED}; then
+        # This tree's ARI documentation was generated, and checked, before
+        rm -rf doc/rest-api
+        cp -r ${DOCS_CACHE}/rest-api doc/rest-api
+    else
+        # Generate latest ARI documentation
+        make ari-stubs
 
-    # Ensure docs are consistent with the implementation
-    CHANGES=$(${GIT} status | grep 'modified:' | wc -l)
-    if test ${CHANGES} -ne 0; then
-        fail "Asterisk code out of date compared to the model"
-    fi
+        # Ensure docs are consistent with the implementation
+        CHANGES=$(${GIT} status | grep 'modified:' | wc -l)
+        if test ${CHANGES} -ne 0; then
+            fail "Asterisk code out of date compared to the model"
+        fi
 
-    # make ari-stubs may modify the $Revision$ tags in a file; revert the
-    # changes
-    ${GIT} reset --hard
+        # make ari-stubs may modify the $Revision$ tags in a file; revert the
+        # changes
+        ${GIT} reset --hard
+    fi
 fi
 
 #
@@ -147,7 +262,8 @@ if test ${BRANCH_NAME} = 'master'; then
 fi
 
 #
-# Publish the REST API.
+# Publish the REST API. It doesn't need Asterisk built, so do it while that's
+# happening, and while the XML documentation is published.
 #
 if test ${HAS_REST_API}; then
     if ${DRY_RUN}; then
@@ -160,51 +276,75 @@ if test ${HAS_REST_API}; then
         ${DRY_RUN_ARG} \
         --verbose \
         --ast-version="${AST_VER}" \
+        --jobs="${CONFLUENCE_JOBS}" \
         ${CONFLUENCE_URL} \
         ${CONFLUENCE_SPACE} \
-        "Asterisk ${BRANCH_NAME}"
+        "Asterisk ${BRANCH_NAME}" > ${STAGE_LOGS}/rest-api.log 2>&1 &
+    REST_API_PID=$!
 fi
 
 #
 # XML docs need a live Asterisk to interact with, so build one
 #
-case ${BRANCH_NAME} in
-    1.8|10*)
-        # 10 and earlier only had core docs
-        make doc/core-en_US.xml
-        mv -f doc/core-en_US.xml ${TOPDIR}/asterisk-docs.xml
-        ;;
-    11)
-        # 11 had full docs
-        make doc/full-en_US.xml
-        mv -f doc/core-en_US.xml ${TOPDIR}/asterisk-docs.xml
-        ;;
-    *)
-        # 12 and later needs to run Asterisk, so a full build
-        # is necessary
-        NPROC=1
-        if which nproc > /dev/null 2>&1; then
-            NPROC=$(nproc)
-        fi
-        JOBS=$(( ${NPROC} + ${NPROC} / 2 ))
-        make -j ${JOBS} full && make install samples
-
-        killall -9 asterisk || true # || true so set -e doesn't kill us
-        ${AST_DIR}/sbin/asterisk &
-        sleep 1
-
-        rm -f ${TOPDIR}/full-en_US.xml
-        ${AST_DIR}/sbin/asterisk -x "core waitfullybooted"
-        ${AST_DIR}/sbin/asterisk -x "xmldoc dump ${TOPDIR}/asterisk-docs.xml"
-
-        # Kill Asterisk, and wait for it to die
-        AST_PID=$(cat ${AST_DIR}/var/run/asterisk/asterisk.pid)
-        killall -9 asterisk || true # || true so set -e doesn't kill us
-        while kill -0 ${AST_PID}; do
-            sleep 0.1
-        done
-        ;;
-esac
+if ${DOCS_CACHED}; then
+    echo "Using the documentation cached in ${DOCS_CACHE}"
+    cp ${DOCS_CACHE}/asterisk-docs.xml ${TOPDIR}/asterisk-docs.xml
+else
+    case ${BRANCH_NAME} in
+        1.8|10*)
+            # 10 and earlier only had core docs
+            make doc/core-en_US.xml
+            mv -f doc/core-en_US.xml ${TOPDIR}/asterisk-docs.xml
+            ;;
+        11)
+            # 11 had full docs
+            make doc/full-en_US.xml
+            mv -f doc/core-en_US.xml ${TOPDIR}/asterisk-docs.xml
+            ;;
+        *)
+            # 12 and later needs to run Asterisk, so a full build
+            # is necessary
+            NPROC=1
+            if which nproc > /dev/null 2>&1; then
+                NPROC=$(nproc)
+            fi
+            JOBS=$(( ${NPROC} + ${NPROC} / 2 ))
+            # The build depends on the modules selected too, so a kept build
+            # is only reused with the same options
+            AST_BUILD_ID=${AST_REV}-$(echo "${MODULES}" | sha1sum | \
+                cut -d ' ' -f 1)
+            if test ${AST_STAMP} && test -x ${AST_DIR}/sbin/asterisk && \
+                    test "$(cat ${AST_STAMP} 2> /dev/null)" = ${AST_BUILD_ID}; then
+                echo "Reusing the build of ${AST_REV} in ${AST_DIR}"
+            else
+                if test ${AST_STAMP}; then
+                    rm -f ${AST_STAMP}
+                fi
+                make -j ${JOBS} full && make install samples
+                if test ${AST_STAMP}; then
+                    echo ${AST_BUILD_ID} > ${AST_STAMP}
+                fi
+            fi
+
+            killall -9 asterisk || true # || true so set -e doesn't kill us
+            # Run in the foreground of a background job, to wait for it
+            ${AST_DIR}/sbin/asterisk -f &
+            AST_PID=$!
+
+            # The remote console can't connect until Asterisk is up
+            rm -f ${TOPDIR}/full-en_US.xml
+            wait_for ${AST_BOOT_TIMEOUT} \
+                ${AST_DIR}/sbin/asterisk -x "core waitfullybooted"
+            ${AST_DIR}/sbin/asterisk -x "xmldoc dump ${TOPDIR}/asterisk-docs.xml"
+
+            # Kill Asterisk, and wait for it to die
+            kill -9 ${AST_PID}
+            wait ${AST_PID} || true # || true so set -e doesn't kill us
+            ;;
+    esac
+
+    store_docs
+fi
 
 #
 # Set the prefix argument for publishing docs
@@ -229,11 +369,21 @@ fi
 # Script assumes that it's running from TOPDIR
 cd ${TOPDIR}
 
+# The REST API is still being published, so see that through even if this
+# fails.  A run that died part way through is picked up where it left off.
+XML_STATUS=0
 ${TOPDIR}/astxml2wiki.py --username="${CONFLUENCE_USER}" \
     --server=${CONFLUENCE_URL} \
     --prefix="${PREFIX}" \
     --space="${CONFLUENCE_SPACE}" \
     --file=${TOPDIR}/asterisk-docs.xml \
     --ast-version="${AST_VER}" \
+    --jobs="${CONFLUENCE_JOBS}" \
+    --resume \
     ${DRY_RUN_ARG} \
-    -v
+    -v || XML_STATUS=$?
+
+if test ${HAS_REST_API}; then
+    wait_stage ${REST_API_PID} ${STAGE_LOGS}/rest-api.log
+fi
+exit ${XML_STATUS}
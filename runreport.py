@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""Run Report
+
+This module collects where the time of a publishing run goes: wall clock and
+CPU time for each phase of the run, the number, latency and size of the calls
+made to Confluence, and the pages that took the longest to publish.  The
+report is written out as JSON at the end of the run.
+
+Phases may be timed from several threads at once, in which case their wall
+clock times add up to more than the run took, and their CPU times include
+whatever the other threads were doing.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+
+# Upper bounds, in milliseconds, of the call latency histogram's buckets
+BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# How many of the slowest pages to keep
+SLOWEST = 20
+
+
+def cpu_time():
+    """The CPU time used by this process so far."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+class Phase:
+    """Times one pass through a phase; see Report.phase()."""
+
+    def __init__(self, report, name):
+        self.report = report
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = cpu_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.report.add(self.name, time.time() - self.wall,
+                        cpu_time() - self.cpu)
+        return False
+
+
+class Report:
+    """Timings and call statistics for a publishing run."""
+
+    def __init__(self, script):
+        """Start timing a run.
+
+        Keyword Arguments:
+        script -- The name of the script doing the run.
+        """
+        self.script = script
+        self.started = time.time()
+        self.started_cpu = cpu_time()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.calls = {}
+        self.pages = []
+        self.counts = {}
+
+    def phase(self, name):
+        """Time a phase of the run, as a context manager:
+
+            with report.phase('parse'):
+                ...
+        """
+        return Phase(self, name)
+
+    def add(self, name, wall, cpu=0):
+        """Add time spent in a phase."""
+        with self.lock:
+            phase = self.phases.setdefault(name, {
+                'count': 0,
+                'wall': 0.0,
+                'cpu': 0.0,
+            })
+            phase['count'] += 1
+            phase['wall'] += wall
+            phase['cpu'] += cpu
+
+    def call(self, method, seconds, sent, received, failed=False):
+        """Record a call to the server.
+
+        Keyword Arguments:
+        method -- The API method called.
+        seconds -- How long the call took.
+        sent -- Bytes sent in the request.
+        received -- Bytes received in the response.
+        failed -- Whether the call failed.
+        """
+        milliseconds = seconds * 1000
+        for bucket in BUCKETS:
+            if milliseconds <= bucket:
+                bucket = '<=%d' % bucket
+                break
+        else:
+            bucket = '>%d' % BUCKETS[-1]
+
+        with self.lock:
+            stats = self.calls.setdefault(method, {
+                'count': 0,
+                'failed': 0,
+                'seconds': 0.0,
+                'max': 0.0,
+                'sent': 0,
+                'received': 0,
+                'histogram': dict.fromkeys(
+                    ['<=%d' % b for b in BUCKETS] + ['>%d' % BUCKETS[-1]], 0),
+            })
+            stats['count'] += 1
+            stats['failed'] += failed and 1 or 0
+            stats['seconds'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            stats['sent'] += sent
+            stats['received'] += received
+            stats['histogram'][bucket] += 1
+
+    def page(self, title, seconds):
+        """Record how long a page took to publish."""
+        with self.lock:
+            if len(self.pages) < SLOWEST:
+                heapq.heappush(self.pages, (seconds, title))
+            else:
+                heapq.heappushpop(self.pages, (seconds, title))
+
+    def count(self, counts):
+        """Add to the run's counts of what was done, such as pages created."""
+        with self.lock:
+            for k, v in counts.items():
+                self.counts[k] = self.counts.get(k, 0) + v
+
+    def save(self, path):
+        """Write the report out as JSON."""
+        with self.lock:
+            report = {
+                'script': self.script,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                         time.localtime(self.started)),
+                'wall': time.time() - self.started,
+                'cpu': cpu_time() - self.started_cpu,
+                'counts': self.counts,
+                'phases': self.phases,
+                'calls': self.calls,
+                'slowest_pages': [{'title': title, 'seconds': seconds}
+                                  for seconds, title in
+                                  sorted(self.pages, reverse=True)],
+            }
+        tmp = '%s.tmp' % path
+        f = open(tmp, 'w')
+        try:
+            json.dump(report, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp, path)
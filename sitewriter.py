@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""Static Site Output
+
+This module writes rendered documentation pages to a directory instead of
+publishing them to Confluence: one file per page, plus an index page for
+each parent page listing its children.  Pages can be written as wiki markup,
+or converted to HTML that can be browsed without a wiki.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import cgi
+import os
+import re
+import threading
+
+import lxml.etree as etree
+
+import wikiconvert
+
+FORMATS = ['wiki', 'html']
+
+NAMESPACES = {
+    'ac': 'http://atlassian.com/content',
+    'ri': 'http://atlassian.com/resource/identifier',
+}
+
+AC = '{%s}' % NAMESPACES['ac']
+RI = '{%s}' % NAMESPACES['ri']
+
+
+def filename(title):
+    """The name (without extension) of the file a page is written to."""
+    return re.sub(r'[^\w.-]+', '_', title).strip('_')
+
+
+class SiteWriter:
+    """Writes pages, and their parents' indexes, into a directory."""
+
+    def __init__(self, directory, format='wiki'):
+        """Create a writer.
+
+        Keyword Arguments:
+        directory -- Where to write the pages; created if necessary.
+        format -- Either 'wiki' for wiki markup, or 'html'.
+        """
+        if format not in FORMATS:
+            raise ValueError("Unknown output format '%s'" % format)
+        self.directory = directory
+        self.format = format
+        self.lock = threading.Lock()
+        self.children = {}
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def write(self, title, wiki, parent):
+        """Write out a page, and remember it for its parent's index.
+
+        This may be called from several threads at once.
+        """
+        with self.lock:
+            self.children.setdefault(parent, []).append(title)
+        self.write_file(title, wiki)
+
+    def close(self):
+        """Write an index page for each parent page."""
+        for parent, titles in self.children.items():
+            wiki = 'h1. %s\n\n' % parent
+            for title in sorted(titles):
+                wiki += '* [%s]\n' % title
+            self.write_file(parent, wiki)
+
+    def write_file(self, title, wiki):
+        """Write out a single page in the chosen format."""
+        path = os.path.join(self.directory,
+                            '%s.%s' % (filename(title), self.format))
+        if self.format == 'html':
+            content = self.html(title, wiki)
+        else:
+            content = wiki
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        f = open(path, 'w')
+        try:
+            f.write(content)
+        finally:
+            f.close()
+
+    def html(self, title, wiki):
+        """Convert a page to a standalone HTML document.
+
+        The page is converted to storage format, and then the Confluence
+        specific elements are replaced with plain HTML.
+        """
+        if isinstance(wiki, str):
+            wiki = wiki.decode('utf-8')
+        storage = wikiconvert.convert(wiki)
+        body = etree.fromstring(
+            ('<body xmlns:ac="%s" xmlns:ri="%s">%s</body>' %
+             (NAMESPACES['ac'], NAMESPACES['ri'], storage)).encode('utf-8'))
+
+        for link in list(body.iter(AC + 'link')):
+            self.html_link(link)
+        for macro in list(body.iter(AC + 'structured-macro')):
+            self.html_macro(macro)
+        etree.cleanup_namespaces(body)
+
+        return '<!DOCTYPE html>\n<html><head><meta charset="utf-8"/>' \
+            '<title>%s</title></head>%s</html>\n' % (
+                cgi.escape(title), etree.tostring(body, encoding=unicode))
+
+    def html_link(self, link):
+        """Turn an ac:link into an <a href>."""
+        page = link.find(RI + 'page')
+        anchor = link.get(AC + 'anchor')
+        href = ''
+        if page is not None:
+            href = '%s.html' % filename(page.get(RI + 'content-title'))
+        if anchor:
+            href += '#%s' % anchor
+
+        text = link.find(AC + 'plain-text-link-body')
+        rich = link.find(AC + 'link-body')
+        a = etree.Element('a', href=href)
+        if rich is not None:
+            a.text = rich.text
+            a.extend(rich)
+        elif text is not None:
+            a.text = text.text
+        elif page is not None:
+            a.text = page.get(RI + 'content-title')
+        a.tail = link.tail
+        link.getparent().replace(link, a)
+
+    def html_macro(self, macro):
+        """Turn a structured macro into plain HTML."""
+        name = macro.get(AC + 'name')
+        params = dict((p.get(AC + 'name'), p.text or '')
+                      for p in macro.findall(AC + 'parameter'))
+        plain = macro.find(AC + 'plain-text-body')
+        rich = macro.find(AC + 'rich-text-body')
+
+        if name == 'anchor':
+            element = etree.Element('a', id=params.get('', ''))
+        elif plain is not None:
+            element = etree.Element('pre', {'class': name})
+            element.text = plain.text
+        else:
+            element = etree.Element('div', {'class': name})
+            if params.get('title'):
+                etree.SubElement(etree.SubElement(element, 'p'),
+                                 'strong').text = params['title']
+            if rich is not None:
+                element.extend(rich)
+        element.tail = macro.tail
+        macro.getparent().replace(macro, element)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Storage Format Comparison
+
+This module decides whether two copies of a page in Confluence storage format
+(XHTML) are the same.  The server doesn't give back exactly what it was sent,
+or what it converted: entities are written differently (&quot; or ", &#8211;
+or &ndash;), empty elements are <br/> or <br />, attributes move around, and
+some markup is added or dropped along the way.  Comparing the text would see
+these as changes, and update pages that haven't changed.
+
+Instead, each copy is parsed and written out in a canonical form: entities
+replaced by the characters they stand for, attributes sorted, CDATA sections
+as plain text and empty elements written the same way (XML C14N), without the
+markup Confluence adds of its own accord.  Copies are the same if their
+canonical forms are.  Content that isn't well-formed has no canonical form;
+copies of it are only the same if their text is.
+
+Pages can end with a footer that changes from run to run, such as the version
+they were imported from.  Given the text the footer starts with, that text
+and everything after it are left out of the canonical form.  The footer is
+cut from the parsed page rather than from its text, which would leave the
+page's markup unbalanced.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import hashlib
+import htmlentitydefs
+import re
+import threading
+
+import lxml.etree as etree
+
+# The namespaces of Confluence's own elements and attributes (ac:macro,
+# ri:page, ...), which storage format uses without declaring
+NAMESPACES = {
+    'ac': 'http://atlassian.com/content',
+    'ri': 'http://atlassian.com/resource/identifier',
+    'at': 'http://atlassian.com/template',
+}
+
+ROOT = '<root %s>' % ' '.join('xmlns:%s="%s"' % item
+                              for item in sorted(NAMESPACES.items()))
+
+# The entities XML has; storage format uses HTML's as well
+XML_ENTITIES = ['amp', 'lt', 'gt', 'quot', 'apos']
+
+ENTITY = re.compile(r'&([A-Za-z][A-Za-z0-9]*);')
+
+# Markup that Confluence adds to pages, or drops from them, and that doesn't
+# change what they say: (element, attribute, value) for the attributes, and
+# the class of the elements
+IGNORED_ATTRIBUTES = [
+    ('ul', 'type', 'square'),
+]
+IGNORED_CLASSES = ['external-link']
+IGNORED_ELEMENTS = [
+    ('br', 'atl-forced-newline'),
+]
+
+# Pages are compared from several threads, and each needs a parser of its own
+local = threading.local()
+
+
+def entity(match):
+    """A numeric reference for an HTML entity, which the parser knows"""
+    name = match.group(1)
+    if name in XML_ENTITIES or name not in htmlentitydefs.name2codepoint:
+        return match.group(0)
+    return '&#%d;' % htmlentitydefs.name2codepoint[name]
+
+
+def drop(element):
+    """Remove an element, but not the text that follows it"""
+    parent = element.getparent()
+    if element.tail:
+        previous = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + element.tail
+        else:
+            parent.text = (parent.text or '') + element.tail
+    parent.remove(element)
+
+
+def cut(root, footer):
+    """Remove the footer and everything after it from a parsed page"""
+    for element in root.iter():
+        if element.text and footer in element.text:
+            element.text = element.text[:element.text.index(footer)]
+            del element[:]
+            element.tail = None
+            break
+        if element.tail and footer in element.tail:
+            element.tail = element.tail[:element.tail.index(footer)]
+            break
+    else:
+        return
+    while element is not root:
+        parent = element.getparent()
+        while element.getnext() is not None:
+            parent.remove(element.getnext())
+        element = parent
+        if element is not root:
+            element.tail = None
+
+
+def canonical(content, footer=None):
+    """The canonical form of storage format content, as UTF-8, without the
+    footer if one is given.  Raises XMLSyntaxError if the content isn't
+    well-formed."""
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    if not hasattr(local, 'parser'):
+        local.parser = etree.XMLParser(resolve_entities=False, huge_tree=True)
+    root = etree.fromstring(ROOT + ENTITY.sub(entity, content) + '</root>',
+                            local.parser)
+    if footer is not None:
+        cut(root, footer)
+
+    for tag, classname in IGNORED_ELEMENTS:
+        for element in list(root.iter(tag)):
+            if element.get('class') == classname:
+                drop(element)
+    for tag, attribute, value in IGNORED_ATTRIBUTES:
+        for element in root.iter(tag):
+            if element.get(attribute) == value:
+                del element.attrib[attribute]
+    for element in root.iter(etree.Element):
+        classes = element.get('class')
+        if classes is None:
+            continue
+        classes = [c for c in classes.split() if c not in IGNORED_CLASSES]
+        if classes:
+            element.set('class', ' '.join(classes))
+        else:
+            del element.attrib['class']
+
+    return etree.tostring(root, method='c14n')
+
+
+def digest(content, footer=None):
+    """A hash of the canonical form of storage format content"""
+    return hashlib.sha1(canonical(content, footer)).hexdigest()
+
+
+def same(old, new, footer=None):
+    """Whether two copies of a page say the same thing, ignoring the footer
+    if one is given"""
+    if old == new:
+        return True
+    try:
+        return digest(old, footer) == digest(new, footer)
+    except etree.XMLSyntaxError:
+        # What a parser makes of broken markup isn't what it says, so only
+        # the text is compared
+        if footer is not None:
+            old = old.split(footer)[0]
+            new = new.split(footer)[0]
+        return old == new
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""Wiki Markup Conversion
+
+This module converts Confluence wiki markup to Confluence storage format
+(XHTML) locally, without a round trip to the server.  It only handles the
+subset of the markup that astxml2wiki.xslt and the ARI .wiki templates
+produce: headings, paragraphs, lists, tables, the noformat, code, info,
+warning and anchor macros, monospace, bold and italic text, links and
+backslash escapes.
+
+Run as a script, it checks the converter against conversions recorded from
+a Confluence server (see the --record-conversions option of astxml2wiki.py).
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import os
+import re
+import sys
+
+# Macros whose body is preformatted text
+PLAIN_MACROS = ['noformat', 'code']
+
+# Macros whose body is more wiki markup
+RICH_MACROS = ['info', 'warning', 'note', 'tip', 'panel', 'section',
+               'column', 'expand']
+
+MACRO = re.compile(r'\{(%s)(?::([^}]*))?\}(.*?)\{\1\}' %
+                   '|'.join(PLAIN_MACROS + RICH_MACROS), re.S)
+
+HEADING = re.compile(r'^h([1-6])\.\s+(.*)$')
+LIST_ITEM = re.compile(r'^([*#]+)\s+(.*)$')
+TABLE_ROW = re.compile(r'^\s*\|')
+MACRO_LINE = re.compile(r'^\s*\{([a-z]+)(?::([^}]*))?\}\s*$')
+
+INLINE = re.compile(r'''
+      \\(?P<escaped>.)
+    | \{\{(?P<code>.+?)\}\}(?!\})
+    | \{anchor:(?P<anchor>[^}]*)\}
+    | \[(?P<link>(?:\\.|[^\]\\])+)\]
+    | (?<![\w*])\*(?P<strong>[^\s*](?:.*?[^\s\\])??)\*(?![\w*])
+    | (?<![\w_])_(?P<emphasis>[^\s_](?:.*?[^\s\\])??)_(?!\w)
+''', re.X)
+
+
+def escape(text):
+    """Escape text for inclusion in XHTML."""
+    return text.replace('&', '&amp;').replace('<', '&lt;') \
+        .replace('>', '&gt;').replace('"', '&quot;')
+
+
+def cdata(text):
+    """Wrap text in a CDATA section."""
+    return '<![CDATA[%s]]>' % text.replace(']]>', ']]]]><![CDATA[>')
+
+
+def parameters(params):
+    """Split macro parameters (title=Note|linenumbers=true) into pairs.
+
+    A bare first parameter ({code:xml}) is the macro's default parameter.
+    """
+    result = []
+    for param in (params or '').split('|'):
+        if not param:
+            continue
+        if '=' in param:
+            result.append(tuple(param.split('=', 1)))
+        elif not result:
+            result.append(('', param))
+    return result
+
+
+def macro(name, params, body=None):
+    """Build a structured macro."""
+    out = ['<ac:structured-macro ac:name="%s">' % name]
+    for key, value in params:
+        if name == 'code' and key == '':
+            key = 'language'
+        out.append('<ac:parameter ac:name="%s">%s</ac:parameter>' %
+                   (escape(key), escape(value)))
+    if body is not None:
+        out.append(body)
+    out.append('</ac:structured-macro>')
+    return ''.join(out)
+
+
+def link(target):
+    """Convert the inside of a [link]."""
+    text = None
+    parts = re.split(r'(?<!\\)\|', target, 1)
+    if len(parts) == 2:
+        text, target = parts
+    target = target.strip()
+
+    if re.match(r'^(https?|ftp|mailto):', target):
+        return '<a href="%s">%s</a>' % (escape(target),
+                                        inline(text or target))
+
+    page, anchor = target, None
+    if '#' in target:
+        page, anchor = target.split('#', 1)
+
+    out = ['<ac:link']
+    if anchor:
+        out.append(' ac:anchor="%s"' % escape(anchor))
+    out.append('>')
+    if page:
+        out.append('<ri:page ri:content-title="%s" />' % escape(page))
+    if text is not None:
+        body = inline(text)
+        if body == escape(unescape(text)):
+            out.append('<ac:plain-text-link-body>%s</ac:plain-text-link-body>'
+                       % cdata(unescape(text)))
+        else:
+            out.append('<ac:link-body>%s</ac:link-body>' % body)
+    out.append('</ac:link>')
+    return ''.join(out)
+
+
+def unescape(text):
+    """Drop the backslashes from escaped characters."""
+    return re.sub(r'\\(.)', r'\1', text)
+
+
+def inline(text):
+    """Convert the inline markup in a line of text."""
+    out = []
+    pos = 0
+    for match in INLINE.finditer(text):
+        out.append(escape(text[pos:match.start()]))
+        pos = match.end()
+        if match.group('escaped') is not None:
+            out.append(escape(match.group('escaped')))
+        elif match.group('code') is not None:
+            out.append('<code>%s</code>' % inline(match.group('code')))
+        elif match.group('anchor') is not None:
+            out.append(macro('anchor', [('', match.group('anchor'))]))
+        elif match.group('link') is not None:
+            out.append(link(match.group('link')))
+        elif match.group('strong') is not None:
+            out.append('<strong>%s</strong>' % inline(match.group('strong')))
+        else:
+            out.append('<em>%s</em>' % inline(match.group('emphasis')))
+    out.append(escape(text[pos:]))
+    return ''.join(out)
+
+
+def table_row(line):
+    """Convert a table row: || heading || heading || or | cell | cell |."""
+    line = line.strip()
+    cells = []
+    for match in re.finditer(r'(\|\|?)((?:\\.|\[[^\]]*\]|[^|\\])*)', line):
+        tag = 'th' if match.group(1) == '||' else 'td'
+        content = match.group(2).strip()
+        if not content and match.end() == len(line):
+            break
+        cells.append('<%s>%s</%s>' % (tag, inline(content), tag))
+    return '<tr>%s</tr>' % ''.join(cells)
+
+
+def lists(items):
+    """Convert a run of list items, given as (bullets, [lines])."""
+    out = []
+    stack = []
+    for bullets, lines in items:
+        depth = len(bullets)
+        kinds = ['ol' if b == '#' else 'ul' for b in bullets]
+        # Close lists deeper than, or of a different kind than, this item
+        while stack and (len(stack) > depth or
+                         stack != kinds[:len(stack)]):
+            out.append('</li></%s>' % stack.pop())
+        if stack and len(stack) == depth:
+            out.append('</li>')
+        while len(stack) < depth:
+            stack.append(kinds[len(stack)])
+            out.append('<%s>' % stack[-1])
+        out.append('<li>%s' % '<br />'.join(inline(l) for l in lines))
+    while stack:
+        out.append('</li></%s>' % stack.pop())
+    return ''.join(out)
+
+
+def blocks(text):
+    """Convert wiki markup that contains no body macros."""
+    out = []
+    paragraph = []
+    items = []
+    rows = []
+
+    def flush():
+        if paragraph:
+            out.append('<p>%s</p>' % '<br />'.join(inline(l)
+                                                   for l in paragraph))
+            del paragraph[:]
+        if items:
+            out.append(lists(items))
+            del items[:]
+        if rows:
+            out.append('<table><tbody>%s</tbody></table>' % ''.join(rows))
+            del rows[:]
+
+    for line in text.split('\n'):
+        heading = HEADING.match(line)
+        item = LIST_ITEM.match(line)
+        if not line.strip():
+            flush()
+        elif heading:
+            flush()
+            out.append('<h%s>%s</h%s>' % (heading.group(1),
+                                          inline(heading.group(2).strip()),
+                                          heading.group(1)))
+        elif item:
+            if paragraph or rows:
+                flush()
+            items.append((item.group(1), [item.group(2)]))
+        elif TABLE_ROW.match(line):
+            if paragraph or items:
+                flush()
+            rows.append(table_row(line))
+        elif MACRO_LINE.match(line) and \
+            not line.strip().startswith('{anchor:'):
+            flush()
+            match = MACRO_LINE.match(line)
+            out.append(macro(match.group(1), parameters(match.group(2))))
+        elif items:
+            # Lines following a list item continue it
+            items[-1][1].append(line)
+        else:
+            if rows:
+                flush()
+            paragraph.append(line)
+    flush()
+    return ''.join(out)
+
+
+def convert(wiki):
+    """Convert wiki markup to Confluence storage format."""
+    out = []
+    pos = 0
+    for match in MACRO.finditer(wiki):
+        out.append(blocks(wiki[pos:match.start()]))
+        pos = match.end()
+        name, params, body = match.groups()
+        if name in PLAIN_MACROS:
+            body = body.strip('\n')
+            out.append(macro(name, parameters(params),
+                             '<ac:plain-text-body>%s</ac:plain-text-body>' %
+                             cdata(body)))
+        else:
+            out.append(macro(name, parameters(params),
+                             '<ac:rich-text-body>%s</ac:rich-text-body>' %
+                             convert(body)))
+    out.append(blocks(wiki[pos:]))
+    return ''.join(out)
+
+
+def normalize(content):
+    """Make conversions comparable, ignoring whitespace between tags."""
+    return re.sub(r'>\s+<', '><', content.strip())
+
+
+def main(argv):
+    """Check the converter against recorded server conversions.
+
+    Each directory given holds pairs of files, NAME.wiki and NAME.xml, with
+    wiki markup and the server's conversion of it.
+    """
+    if len(argv) < 2:
+        print >> sys.stderr, "Usage: %s DIRECTORY..." % argv[0]
+        return 2
+
+    checked = 0
+    failed = 0
+    for directory in argv[1:]:
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.wiki'):
+                continue
+            base = os.path.join(directory, name[:-len('.wiki')])
+            if not os.path.exists(base + '.xml'):
+                continue
+            wiki = open(base + '.wiki').read().decode('utf-8')
+            expected = open(base + '.xml').read().decode('utf-8')
+            checked += 1
+            if normalize(convert(wiki)) != normalize(expected):
+                failed += 1
+                print "Mismatch: %s" % base
+    print "%d checked, %d mismatched" % (checked, failed)
+    return failed and 1 or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)
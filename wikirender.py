@@ -0,0 +1,603 @@
+#!/usr/bin/env python
+"""Wiki Markup Rendering
+
+This module renders the documentation of an element (an application,
+function, AGI command, manager action or event, or module configuration) to
+wiki markup in Python, as an alternative to astxml2wiki.xslt.  Its output is
+byte for byte the same as the stylesheet's, quirks included; each template
+of the stylesheet has a method here, named after the element it matches.
+
+Run as a script, it renders every element of a documentation file with both
+the stylesheet and the renderer, and reports any differences between them.
+
+This program is free software, distributed under the terms of
+the GNU General Public License Version 2.
+"""
+
+import difflib
+import re
+import sys
+import time
+from optparse import OptionParser
+
+import lxml.etree as etree
+
+# The elements documented on pages of their own
+TOPICS = ['manager', 'application', 'function', 'agi', 'managerEvent',
+          'configInfo']
+
+# XPath's whitespace, for normalize-space()
+WHITESPACE = re.compile(r'[ \t\r\n]+')
+
+# What the stylesheet strips from configuration option names
+OPTION_CHARS = re.compile(r'[\\%!@${}&^\[\]|+]')
+
+LOWERCASE = re.compile(r'[a-z]+')
+
+# What links to pages of each type of element are called, as in page_title()
+# of astxml2wiki.py
+LINKS = {
+    'manager': 'ManagerAction_',
+    'application': 'Application_',
+    'function': 'Function_',
+    'agi': 'AGICommand_',
+    'managerEvent': 'ManagerEvent_',
+    'configInfo': 'Configuration_',
+}
+
+
+def normalize_space(text):
+    """XPath's normalize-space()"""
+    if isinstance(text, unicode):
+        return WHITESPACE.sub(' ', text).strip(' ')
+    # Python's other ASCII whitespace characters can't appear in XML, so
+    # splitting on whitespace is the same here, and faster
+    return ' '.join(text.split())
+
+
+def upper(text):
+    """The stylesheet's translate() to upper case, which is only ASCII"""
+    return LOWERCASE.sub(lambda m: m.group(0).upper(), text)
+
+
+def string_value(node):
+    """XPath's string value of an element: all of the text in it, without
+    comments or processing instructions"""
+    if not len(node):
+        return node.text or ''
+    parts = [node.text or '']
+    for child in node:
+        if isinstance(child.tag, basestring):
+            parts.append(string_value(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+NONE = ()
+
+
+def children(node):
+    """The child elements of a node, grouped by tag, and all of them in
+    document order under None"""
+    groups = {None: []}
+    if len(node):
+        for child in node.iterchildren(etree.Element):
+            groups[None].append(child)
+            groups.setdefault(child.tag, []).append(child)
+    return groups
+
+
+def required(node):
+    return node.get('required') in ('true', 'yes')
+
+
+def optional(node):
+    return node.get('required') in ('false', 'no')
+
+
+def multiple(node):
+    return node.get('multiple') in ('true', 'yes')
+
+
+def argsep(node):
+    """The separator between the children of a node: its argsep, or ','"""
+    sep = node.get('argsep')
+    if sep is None:
+        return ','
+    return sep
+
+
+class Renderer:
+    """Renders elements to wiki markup, as astxml2wiki.xslt does."""
+
+    def __init__(self, prefix=''):
+        """Keyword Arguments:
+        prefix -- Page title prefix (e.g. 'Asterisk 13 '), used to build links
+                  to other pages; the stylesheet's prefix parameter.
+        """
+        self.prefix = prefix
+        self.templates = {
+            'application': self.application,
+            'function': self.function,
+            'agi': self.agi,
+            'manager': self.manager,
+            'managerEvent': self.manager_event,
+            'managerEventInstance': self.manager_event_instance,
+            'configInfo': self.config_info,
+            'configFile': self.config_file,
+            'configObject': self.config_object,
+            'configOption': self.config_option,
+            'synopsis': self.synopsis,
+            'description': self.description,
+            'syntax': self.syntax,
+            'see-also': self.see_also,
+            'ref': self.ref,
+            'info': self.info,
+            'parameter': self.parameter,
+            'argument': self.argument,
+            'para': self.para,
+            'example': self.example,
+            'note': self.note,
+            'warning': self.warning,
+            'variablelist': self.variablelist,
+            'variable': self.variable,
+            'enumlist': self.enumlist,
+            'enum': self.enum,
+            'optionlist': self.optionlist,
+            'option': self.option,
+        }
+
+    def render(self, node):
+        """Render an element, returning its wiki markup as UTF-8."""
+        out = []
+        self.apply([node], out, {})
+        return u''.join(out).encode('utf-8')
+
+    def apply(self, nodes, out, params):
+        """xsl:apply-templates: templates only see the parameters they
+        declare, as keyword arguments.  Elements without a template have
+        their children's applied, with the same parameters (as libxslt's
+        built-in template does); text is dropped."""
+        for node in nodes:
+            template = self.templates.get(node.tag)
+            if template is not None:
+                template(node, out, **params)
+            elif isinstance(node.tag, basestring):
+                self.apply(node.iterchildren(etree.Element), out, params)
+
+    def module(self, node, out):
+        if node.get('module') is not None:
+            out.append(' - \\[%s\\]' % node.get('module'))
+
+    def sections(self, kids, out, topic, name):
+        """Synopsis, description and syntax, as every topic has them"""
+        out.append('\n\nh3. Synopsis\n\n')
+        self.apply(kids.get('synopsis', NONE), out, {})
+        out.append('\n\nh3. Description\n\n')
+        self.apply(kids.get('description', NONE), out, {})
+        out.append('h3. Syntax\n\n')
+        self.apply(kids.get('syntax', NONE), out,
+                   {'type': topic, 'name': name})
+
+    def application(self, node, out, **params):
+        kids = children(node)
+        out.append('h1. %s()' % node.get('name', ''))
+        self.module(node, out)
+        self.sections(kids, out, 'application', node.get('name', ''))
+        out.append('h3. See Also\n\n')
+        self.apply(kids.get('see-also', NONE), out, {})
+
+    def function(self, node, out, **params):
+        kids = children(node)
+        out.append('h1. %s()' % node.get('name', ''))
+        self.module(node, out)
+        self.sections(kids, out, 'function', node.get('name', ''))
+        out.append('h3. See Also\n\n')
+        self.apply(kids.get('see-also', NONE), out, {})
+
+    def agi(self, node, out, **params):
+        kids = children(node)
+        out.append('h1. %s' % upper(node.get('name', '')))
+        self.module(node, out)
+        self.sections(kids, out, 'agi', node.get('name', ''))
+        out.append('h3. See Also\n')
+        self.apply(kids.get('see-also', NONE), out, {})
+        out.append('\n')
+
+    def manager(self, node, out, **params):
+        kids = children(node)
+        out.append('h1. %s' % node.get('name', ''))
+        self.module(node, out)
+        self.sections(kids, out, 'manager', node.get('name', ''))
+        out.append('h3. See Also\n')
+        self.apply(kids.get('see-also', NONE), out, {})
+
+    def manager_event(self, node, out, **params):
+        out.append('h1. %s' % node.get('name', ''))
+        self.module(node, out)
+        out.append('\n\n')
+        self.apply(node.iterchildren('managerEventInstance'), out,
+                   {'name': node.get('name', '')})
+
+    def manager_event_instance(self, node, out, name='', **params):
+        kids = children(node)
+        out.append('h3. Synopsis\n\n')
+        self.apply(kids.get('synopsis', NONE), out, {})
+        out.append('\n\nh3. Description\n\n')
+        self.apply(kids.get('description', NONE), out, {})
+        out.append('h3. Syntax\n\n')
+        self.apply(kids.get('syntax', NONE), out,
+                   {'type': 'managerEvent', 'name': name})
+        out.append('h3. Class\n\n')
+        out.append(node.get('class', '')[11:])
+        out.append('\nh3. See Also\n')
+        self.apply(kids.get('see-also', NONE), out, {})
+
+    def config_info(self, node, out, **params):
+        kids = children(node)
+        synopses = kids.get('synopsis', NONE)
+        if synopses:
+            out.append('h1. ')
+            self.apply(synopses, out, {})
+        out.append('\n\nThis configuration documentation is for functionality '
+                   'provided by {{%s}}.\n\n' % node.get('name', ''))
+        descriptions = kids.get('description', NONE)
+        if descriptions:
+            out.append('h2. Overview\n\n')
+            self.apply(descriptions, out, {})
+        self.apply(kids.get('configFile', NONE), out, {})
+
+    def config_file(self, node, out, **params):
+        out.append('h2. %s\n\n' % node.get('name', ''))
+        self.apply(node.iterchildren('configObject'), out, {})
+
+    def config_object(self, node, out, **params):
+        kids = children(node)
+        name = node.get('name', '')
+        out.append('h3. %s\n\n' % name)
+        self.apply(kids.get('synopsis', NONE), out, {})
+        out.append('\n\n')
+        options = kids.get('configOption', NONE)
+        if options:
+            out.append('h4. Configuration Option Reference\n\n'
+                       '|| Option Name || Type || Default Value '
+                       '|| Regular Expression || Description ||\n')
+        self.apply(options, out, {'object_name': name, 'summary': 'true'})
+        for option in options:
+            if option.find('description') is not None:
+                out.append('h4. Configuration Option Descriptions\n\n')
+                self.apply(options, out,
+                           {'object_name': name, 'summary': 'false'})
+                break
+
+    def config_option_attribute(self, value, out, description=False,
+                                object_name=''):
+        """The configOption/@* template: a cell of the option table"""
+        out.append('| ')
+        if len(value) > 0:
+            if description:
+                out.append('[')
+            out.append('{{%s}}' % OPTION_CHARS.sub('', value))
+            if description:
+                out.append('|#%s_%s]' % (object_name,
+                                         OPTION_CHARS.sub('', value)))
+        out.append(' ')
+
+    def config_option(self, node, out, object_name='', summary='', **params):
+        kids = children(node)
+        if summary == 'true':
+            if node.get('name') is not None:
+                self.config_option_attribute(
+                    node.get('name'), out,
+                    description='description' in kids,
+                    object_name=object_name)
+            for attribute in ['type', 'default', 'regex']:
+                if node.get(attribute) is not None:
+                    self.config_option_attribute(node.get(attribute), out)
+                else:
+                    out.append('| ')
+            out.append('| ')
+            self.apply(kids.get('synopsis', NONE), out, {})
+            out.append(' |\n')
+        if summary == 'false':
+            descriptions = kids.get('description', NONE)
+            if descriptions:
+                name = OPTION_CHARS.sub('', node.get('name', ''))
+                out.append('{anchor:%s_%s}\nh5. %s\n\n' % (object_name, name,
+                                                          name))
+                self.apply(descriptions, out, {})
+
+    def synopsis(self, node, out, **params):
+        out.append(normalize_space(string_value(node)))
+
+    def description(self, node, out, **params):
+        self.apply(node.iterchildren(etree.Element), out,
+                   {'bullet': '*', 'returntype': ''})
+        out.append('\n')
+
+    def syntax(self, node, out, type='', name='', **params):
+        """How each type of element is called, and then its arguments"""
+        out.append('\n{noformat}')
+        parameters = node.findall('parameter')
+        if type == 'application':
+            self.application_syntax(node, parameters, out, name)
+        elif type == 'function':
+            sep = argsep(node)
+            out.append('%s(' % upper(name))
+            for i, parameter in enumerate(parameters):
+                if optional(parameter):
+                    out.append('[')
+                if i > 0:
+                    out.append(sep)
+                out.append(parameter.get('name', ''))
+                if multiple(parameter):
+                    out.append('[%s...]' % sep)
+            out.append(']' * len([p for p in parameters if optional(p)]))
+            out.append(')')
+        elif type == 'agi':
+            out.append('%s ' % upper(name))
+            for parameter in parameters:
+                if optional(parameter):
+                    out.append('[%s] ' % upper(parameter.get('name', '')))
+                else:
+                    out.append('%s ' % upper(parameter.get('name', '')))
+        elif type in ('manager', 'managerEvent'):
+            out.append('\n%s: %s\n' % (
+                type == 'manager' and 'Action' or 'Event', name))
+            for parameter in parameters:
+                if optional(parameter):
+                    out.append('[%s:] <value>\n' % parameter.get('name', ''))
+                else:
+                    out.append('%s: <value>\n' % parameter.get('name', ''))
+        out.append('{noformat}\n\nh5. Arguments\n\n')
+        if parameters:
+            self.apply(parameters, out, {'bullet': '*'})
+            out.append('\n')
+
+    def application_syntax(self, node, parameters, out, name):
+        """Nests optional parameters and arguments in brackets, closing
+        the parameters' brackets all at once at the end."""
+        sep = argsep(node)
+        last = len(parameters) - 1
+        # Closes the optional parameters, when the last one is required
+        closing = ']' * len([p for p in parameters[:-1] if not required(p)])
+
+        out.append('%s(' % name)
+        for i, parameter in enumerate(parameters):
+            arguments = parameter.findall('argument')
+            if arguments:
+                if i == last and required(parameter):
+                    out.append(closing)
+                hasparams = parameter.get('hasparams')
+                if hasparams is not None:
+                    out.append(parameter.get('name', ''))
+                    if hasparams == 'optional':
+                        out.append('[')
+                    out.append('(')
+                argument_sep = argsep(parameter)
+                for j, argument in enumerate(arguments):
+                    if not required(argument):
+                        out.append('[')
+                    out.append(argument.get('name', ''))
+                    if j != len(arguments) - 1:
+                        out.append(argument_sep)
+                    if multiple(argument):
+                        out.append('[')
+                        if j == len(arguments) - 1:
+                            out.append(argument_sep)
+                        out.append('...]')
+                out.append(']' * len([a for a in arguments
+                                      if not required(a)]))
+                if hasparams is not None:
+                    if hasparams == 'optional':
+                        out.append(']')
+                    out.append(')')
+                if i != last:
+                    out.append(sep)
+            else:
+                if not required(parameter):
+                    out.append('[')
+                if i == last and required(parameter):
+                    out.append(closing)
+                out.append(parameter.get('name', ''))
+                if i != last:
+                    out.append(sep)
+                if multiple(parameter):
+                    out.append('[%s...]' % sep)
+                if i == last and not required(parameter):
+                    out.append(']' * len([p for p in parameters
+                                          if not required(p)]))
+        out.append(')')
+
+    def see_also(self, node, out, **params):
+        self.apply(node.iterchildren(etree.Element), out, {})
+        out.append('\n')
+
+    def ref(self, node, out, **params):
+        """Links to other pages are named the same way astxml2wiki.py names
+        the pages themselves.  Anything else is a filename or a manpage."""
+        link = LINKS.get(node.get('type'))
+        if link is None:
+            text = '{{%s}}' % string_value(node)
+        else:
+            module = node.get('module', '')
+            if len(module) > 0:
+                module = '_' + module
+            text = '[%s%s%s%s]' % (self.prefix, link, string_value(node),
+                                   module)
+        out.append('* %s\n' % normalize_space(text))
+
+    def info(self, node, out, bullet='', **params):
+        kids = children(node)
+        out.append('\n')
+        if len(bullet) != 0:
+            out.append('%s ' % bullet[:-1])
+        out.append('*Technology: %s*\n' % node.get('tech', ''))
+        if 'para' in kids:
+            # The stylesheet applies the templates of every child here, not
+            # just the paragraphs
+            self.apply(kids[None], out, {'returntype': 'single'})
+        self.apply(kids.get('example', NONE), out, {})
+        self.apply(kids.get('note', NONE), out, {'returntype': 'single'})
+        self.apply(kids.get('warning', NONE), out, {'returntype': 'single'})
+        self.apply(kids.get('variablelist', NONE), out, {'bullet': bullet})
+        self.apply(kids.get('enumlist', NONE), out, {'bullet': bullet})
+
+    def described(self, kids, out):
+        """What follows a name in a list: its paragraphs, or a new line"""
+        if 'para' in kids:
+            out.append(' - ')
+            self.apply(kids.get('para', NONE), out, {'returntype': 'single'})
+        else:
+            out.append('\n')
+
+    def parameter(self, node, out, bullet='', **params):
+        kids = children(node)
+        out.append('%s {{%s}}' % (bullet, node.get('name', '')))
+        out.append('para' in kids and ' - ' or '\n')
+        self.apply(kids[None], out,
+                   {'bullet': bullet + '*', 'returntype': 'single'})
+
+    def argument(self, node, out, bullet='', separator=',', **params):
+        kids = children(node)
+        name = node.get('name', '')
+        if required(node):
+            out.append('%s {{*%s*}}' % (bullet, name))
+        else:
+            out.append('%s {{%s}}' % (bullet, name))
+        if multiple(node):
+            out.append('\\[%s{{%s}}...\\]' % (separator, name))
+        hasparams = node.get('hasparams')
+        if hasparams in ('yes', 'true'):
+            out.append('{{( *params* )}}')
+        elif hasparams == 'optional':
+            out.append('{{( params )}}')
+        out.append('para' in kids and ' - ' or '\n')
+        self.apply(kids[None], out,
+                   {'bullet': bullet + '*',
+                    'separator': node.get('argsep', ''),
+                    'returntype': 'single'})
+
+    def para(self, node, out, returntype='', **params):
+        """Paragraphs are followed by a blank line, or with a returntype,
+        just a new line or nothing at all"""
+        out.append(normalize_space(string_value(node)))
+        if returntype == 'single':
+            out.append('\n')
+        elif returntype != 'none':
+            out.append('\n\n')
+
+    def example(self, node, out, **params):
+        out.append('{code:')
+        if node.get('title') is not None:
+            out.append('|title=Example: %s' % node.get('title'))
+        out.append('|linenumbers=true')
+        if node.get('language') is not None:
+            out.append('|language=%s' % node.get('language'))
+        out.append('}\n%s\n{code}' % string_value(node))
+
+    def note(self, node, out, returntype='', **params):
+        out.append('{info:title=Note}\n')
+        self.apply(node.iterchildren('para'), out, {'returntype': returntype})
+        out.append('{info}\n')
+
+    def warning(self, node, out, returntype='', **params):
+        out.append('{warning:title=Warning}\n')
+        self.apply(node.iterchildren('para'), out, {'returntype': returntype})
+        out.append('{warning}\n')
+
+    def variablelist(self, node, out, bullet='', **params):
+        self.apply(node.iterchildren('variable'), out, {'bullet': bullet})
+
+    def variable(self, node, out, bullet='', **params):
+        kids = children(node)
+        out.append('%s {{%s}}' % (bullet, upper(node.get('name', ''))))
+        self.described(kids, out)
+        for value in kids.get('value', NONE):
+            out.append('%s* %s' % (bullet, upper(value.get('name', ''))))
+            if len(value.get('default', '')) > 0:
+                out.append(' default: (%s)' % value.get('default'))
+            text = string_value(value)
+            if len(text) > 0:
+                out.append(' - %s' % normalize_space(text))
+            out.append('\n')
+
+    def enumlist(self, node, out, bullet='', **params):
+        self.apply(node.iterchildren('enum'), out, {'bullet': bullet})
+
+    def enum(self, node, out, bullet='', **params):
+        kids = children(node)
+        out.append('%s {{%s}}' % (bullet, node.get('name', '')))
+        self.described(kids, out)
+        self.apply(kids.get('parameter', NONE), out, {'bullet': bullet + '*'})
+        self.apply(kids.get('enumlist', NONE), out, {'bullet': bullet + '*'})
+        self.apply(kids.get('note', NONE), out, {'returntype': 'single'})
+        self.apply(kids.get('warning', NONE), out, {'returntype': 'single'})
+
+    def optionlist(self, node, out, bullet='', **params):
+        self.apply(node.iterchildren('option'), out, {'bullet': bullet})
+
+    def option(self, node, out, bullet='', **params):
+        kids = children(node)
+        out.append('%s {{%s}}' % (bullet, node.get('name', '')))
+        arguments = kids.get('argument', NONE)
+        if arguments:
+            names = []
+            for argument in arguments:
+                if required(argument):
+                    names.append('*%s*' % argument.get('name', ''))
+                else:
+                    names.append(argument.get('name', ''))
+            out.append('{{( %s )}}' % argsep(node).join(names))
+        self.described(kids, out)
+        self.apply(kids.get('variablelist', NONE), out,
+                   {'bullet': bullet + '*'})
+        self.apply(arguments, out, {'bullet': bullet + '*',
+                                    'separator': node.get('argsep', '')})
+        self.apply(kids.get('enumlist', NONE), out, {'bullet': bullet + '*'})
+
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options] asterisk-docs.xml")
+    parser.add_option("--prefix", default="",
+                      help="Page title prefix, e.g. 'Asterisk 13 '")
+    parser.add_option("--stylesheet", default="astxml2wiki.xslt",
+                      help="The stylesheet to compare with")
+    parser.add_option("--show", type="int", default=5,
+                      help="How many differences to print")
+    (options, args) = parser.parse_args(argv)
+
+    if len(args) != 2:
+        parser.error("Wrong number of arguments")
+
+    tree = etree.parse(args[1])
+    tree.xinclude()
+    nodes = [node for node in tree.getiterator() if node.tag in TOPICS]
+
+    xslt = etree.XSLT(etree.parse(options.stylesheet))
+    prefix = etree.XSLT.strparam(options.prefix)
+    started = time.time()
+    expected = [str(xslt(node, prefix=prefix)) for node in nodes]
+    xslt_time = time.time() - started
+
+    renderer = Renderer(options.prefix)
+    started = time.time()
+    rendered = [renderer.render(node) for node in nodes]
+    python_time = time.time() - started
+
+    different = 0
+    for node, wiki, python_wiki in zip(nodes, expected, rendered):
+        if wiki == python_wiki:
+            continue
+        different += 1
+        if different <= options.show:
+            print "%s %s differs:" % (node.tag, node.get('name'))
+            sys.stdout.writelines(difflib.unified_diff(
+                wiki.splitlines(True), python_wiki.splitlines(True),
+                'xslt', 'python'))
+    print "%d of %d elements differ (xslt %.2fs, python %.2fs)" % (
+        different, len(nodes), xslt_time, python_time)
+    return different and 1 or 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv) or 0)